@@ -0,0 +1,308 @@
+"""
+Replay a recorded traffic log against a local API instance and compare with a baseline.
+
+Record on a running service by setting TRAFFIC_RECORD_PATH (see traffic_recorder.py in
+src/lib and xview2-model). Then replay it, at recorded speed or accelerated:
+
+    # flood API + Windy stub, started and stopped by this script
+    python scripts/replay_traffic.py traffic.jsonl --serve flood --speed 10 --baseline perf/flood.json
+
+    # damage API
+    python scripts/replay_traffic.py traffic.jsonl --serve damage --baseline perf/damage.json
+
+    # an instance you started yourself
+    python scripts/replay_traffic.py traffic.jsonl --target http://localhost:8000 --api-key <ndma key>
+
+Uploads are replaced by synthetic JPEGs of the recorded dimensions; uploads that shared a
+content token in the log share identical bytes, so near-duplicate reuse replays as recorded.
+Latency is measured from each request's scheduled send time, so a server that falls behind
+shows up in the percentiles instead of silently slowing the replay down. Endpoints still
+behind the flat per-IP limit will be throttled when one client replays many users' traffic;
+--include restricts the replay to the admission-controlled endpoints.
+
+--save-baseline writes the run's summary. With --baseline, the run fails (exit 1) when an
+endpoint's p95/p99 latency or error rate, or the overall throughput, regresses beyond
+--tolerance.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import re
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import requests
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = {
+    "flood": {"cwd": os.path.join(ROOT, "src", "lib"), "app": "floodPredictionAPI:app"},
+    "damage": {"cwd": os.path.join(ROOT, "xview2-model"), "app": "api:app"},
+}
+STUB_PORT = 8001
+
+
+def load_log(paths, include=None, limit=None):
+    entries = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                if include and not any(entry["p"].startswith(prefix) for prefix in include):
+                    continue
+                entries.append(entry)
+    entries.sort(key=lambda entry: entry["t"])
+    return entries[:limit] if limit else entries
+
+
+def endpoint_key(entry) -> str:
+    """Group paths like /tiles/0/5/22/13.png under one endpoint."""
+    return entry["m"] + " " + re.sub(r"/\d+(?=/|\.|$)", "/{n}", entry["p"])
+
+
+@lru_cache(maxsize=512)
+def synthetic_image(width: int, height: int, token: str) -> bytes:
+    """Smooth random scene of the given size; same token -> same bytes."""
+    width, height = width or 512, height or 512
+    rng = random.Random(token)
+    small = (max(1, width // 32), max(1, height // 32))
+    noise = bytes(rng.getrandbits(8) for _ in range(small[0] * small[1] * 3))
+    image = Image.frombytes("RGB", small, noise).resize((width, height), Image.BICUBIC)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def build_request(entry):
+    kwargs = {}
+    if "json" in entry:
+        kwargs["json"] = entry["json"]
+    if "files" in entry:
+        kwargs["files"] = [
+            (field, (f"replay_{i}.jpg", synthetic_image(width, height, token), "image/jpeg"))
+            for field, shapes in entry["files"].items()
+            for i, (width, height, token) in enumerate(shapes)
+        ]
+        kwargs["data"] = entry.get("form", {})
+    return kwargs
+
+
+def replay(entries, target, speed, concurrency, headers, timeout):
+    """Send each entry at its recorded offset / speed (speed 0 = as fast as possible)."""
+    for entry in entries:
+        build_request(entry)  # synthesise uploads up front so it does not count as latency
+
+    local = threading.local()
+    results = []
+    results_lock = threading.Lock()
+
+    def send(entry, scheduled):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        try:
+            response = session.request(entry["m"], target + entry["p"], headers=headers,
+                                       timeout=timeout, **build_request(entry))
+            status = response.status_code
+        except requests.RequestException:
+            status = 0
+        latency_ms = (time.perf_counter() - scheduled) * 1000
+        with results_lock:
+            results.append((endpoint_key(entry), status, latency_ms))
+
+    first = entries[0]["t"]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for entry in entries:
+            offset = (entry["t"] - first) / speed if speed > 0 else 0.0
+            delay = started + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, entry, started + offset)
+    return results, time.perf_counter() - started
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))
+    return round(sorted_values[index], 1)
+
+
+def _stats(rows, wall_s):
+    latencies = sorted(latency for _, status, latency in rows if 200 <= status < 400)
+    statuses = {}
+    for _, status, _ in rows:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(rows),
+        "ok": len(latencies),
+        "error_rate": round(1 - len(latencies) / len(rows), 4) if rows else 0.0,
+        "statuses": statuses,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "throughput_rps": round(len(latencies) / wall_s, 2) if wall_s else None,
+    }
+
+
+def summarize(results, wall_s, speed):
+    by_endpoint = {}
+    for row in results:
+        by_endpoint.setdefault(row[0], []).append(row)
+    return {
+        "speed": speed,
+        "wall_s": round(wall_s, 2),
+        "overall": _stats(results, wall_s),
+        "endpoints": {key: _stats(rows, wall_s) for key, rows in sorted(by_endpoint.items())},
+    }
+
+
+def compare(current, baseline, tolerance, min_delta_ms, min_samples):
+    """Regressions of the current summary against the baseline, as readable lines."""
+    regressions = []
+    for key, stats in current["endpoints"].items():
+        base = baseline["endpoints"].get(key)
+        if base is None or base["ok"] < min_samples or stats["ok"] < min_samples:
+            continue
+        for metric in ("p95_ms", "p99_ms"):
+            if stats[metric] > base[metric] * (1 + tolerance) and stats[metric] - base[metric] > min_delta_ms:
+                regressions.append(f"{key}: {metric} {base[metric]} -> {stats[metric]}")
+        if stats["error_rate"] > base["error_rate"] + 0.02:
+            regressions.append(f"{key}: error_rate {base['error_rate']} -> {stats['error_rate']}")
+
+    if current.get("speed") == baseline.get("speed"):
+        base_rps = baseline["overall"]["throughput_rps"]
+        rps = current["overall"]["throughput_rps"]
+        if base_rps and rps < base_rps * (1 - tolerance):
+            regressions.append(f"overall: throughput_rps {base_rps} -> {rps}")
+    return regressions
+
+
+def print_summary(summary):
+    print(f"{'endpoint':<40} {'n':>6} {'err%':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8}")
+    rows = list(summary["endpoints"].items()) + [("overall", summary["overall"])]
+    for key, stats in rows:
+        print(f"{key:<40} {stats['requests']:>6} {stats['error_rate'] * 100:>6.1f} "
+              f"{stats['p50_ms'] or '-':>8} {stats['p95_ms'] or '-':>8} {stats['p99_ms'] or '-':>8} "
+              f"{stats['throughput_rps'] or '-':>8}")
+
+
+def _wait_ready(url, process, timeout_s=300):
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} before becoming ready")
+        try:
+            if requests.get(url + "/openapi.json", timeout=2).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} not ready after {timeout_s}s")
+
+
+def serve(service, port, api_key, workdir):
+    """Start the service (and the Windy stub for the flood API) with fresh local state."""
+    env = dict(os.environ, ADMISSION_API_KEYS=f"ndma:{api_key}")
+    env.pop("TRAFFIC_RECORD_PATH", None)
+    processes = []
+    if service == "flood":
+        stub = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "windy_stub:app", "--port", str(STUB_PORT), "--log-level", "warning"],
+            cwd=SERVICES["flood"]["cwd"], env=env
+        )
+        processes.append(stub)
+        _wait_ready(f"http://127.0.0.1:{STUB_PORT}", stub)
+        env.update(
+            WINDY_API_URL=f"http://127.0.0.1:{STUB_PORT}/api/point-forecast/v2",
+            WINDY_API=env.get("WINDY_API", "stub"),
+            FORECAST_STORE_PATH=os.path.join(workdir, "forecast_store.db"),
+            RISK_TILES_DIR=os.path.join(workdir, "risk_tiles"),
+        )
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", SERVICES[service]["app"], "--port", str(port), "--log-level", "warning"],
+        cwd=SERVICES[service]["cwd"], env=env
+    )
+    processes.append(app)
+    _wait_ready(f"http://127.0.0.1:{port}", app)
+    if service == "damage":
+        # The model loads lazily; load it before timing starts
+        requests.get(f"http://127.0.0.1:{port}/health", timeout=300)
+    return processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded API traffic and check for performance regressions")
+    parser.add_argument("logs", nargs="+", help="JSONL traffic logs written by the traffic recorder")
+    parser.add_argument("--target", default="http://127.0.0.1:8000", help="base URL of the instance under test")
+    parser.add_argument("--serve", choices=sorted(SERVICES), help="start this service locally (flood also starts the Windy stub)")
+    parser.add_argument("--port", type=int, default=8000, help="port for --serve")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression factor; 0 sends as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=64, help="max requests in flight")
+    parser.add_argument("--include", action="append", help="only replay paths with this prefix (repeatable)")
+    parser.add_argument("--limit", type=int, help="replay only the first N requests")
+    parser.add_argument("--api-key", help="X-API-Key to send (so admission does not throttle the single replay client)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--baseline", help="baseline summary JSON to compare against")
+    parser.add_argument("--save-baseline", help="write this run's summary here")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="ignore latency regressions smaller than this")
+    parser.add_argument("--min-samples", type=int, default=20, help="endpoints with fewer successful requests are not compared")
+    args = parser.parse_args()
+
+    entries = load_log(args.logs, args.include, args.limit)
+    if not entries:
+        parser.error("no requests to replay")
+
+    processes = []
+    api_key = args.api_key
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            if args.serve:
+                api_key = api_key or secrets.token_hex(16)
+                processes = serve(args.serve, args.port, api_key, workdir)
+                args.target = f"http://127.0.0.1:{args.port}"
+            headers = {"X-API-Key": api_key} if api_key else {}
+            pace = f"{args.speed}x" if args.speed > 0 else "full speed"
+            print(f"Replaying {len(entries)} requests against {args.target} at {pace}", file=sys.stderr)
+            results, wall_s = replay(entries, args.target.rstrip("/"), args.speed, args.concurrency, headers, args.timeout)
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+                process.wait()
+
+    summary = summarize(results, wall_s, args.speed)
+    print_summary(summary)
+    if args.save_baseline:
+        directory = os.path.dirname(args.save_baseline)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(summary, baseline, args.tolerance, args.min_delta_ms, args.min_samples)
+        if regressions:
+            print("\nPerformance regressions against baseline:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            sys.exit(1)
+        print("\nNo regressions against baseline.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
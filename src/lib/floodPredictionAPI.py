@@ -1,15 +1,26 @@
+import asyncio
 import os
 import joblib
 import pandas as pd
 import requests
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response, BackgroundTasks
 from pydantic import BaseModel
+from typing import Optional
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
+from forecast_store import ForecastStore, FEATURE_COLS, series_key, member_series_key
+from single_flight import SingleFlight
+from risk_tiles import TileServer, build_risk_grid
+from admission import AdmissionController, AdmissionRejected, CLASS_LIMITS, CRITICAL, PUBLIC
+from traffic_recorder import TrafficRecorder, TrafficRecorderMiddleware
 
 # --- INITIAL SETUP ---
 load_dotenv()
@@ -31,6 +42,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Optional anonymised traffic log for load replay (scripts/replay_traffic.py)
+traffic_recorder = TrafficRecorder.from_env()
+if traffic_recorder is not None:
+    app.add_middleware(TrafficRecorderMiddleware, recorder=traffic_recorder)
+
 # --- LOAD MODEL & CONFIG ---
 try:
     model = joblib.load("models/flood_prediction_model_smote.pkl")
@@ -41,6 +57,25 @@ WINDY_API_KEY = os.getenv("WINDY_API")
 if not WINDY_API_KEY:
     raise RuntimeError("WINDY_API key not found in .env file.")
 
+# Overridable so local runs and load tests can point at windy_stub.py instead of the real API
+WINDY_API_URL = os.getenv("WINDY_API_URL", "https://api.windy.com/api/point-forecast/v2")
+ENSEMBLE_MODELS = [m.strip() for m in os.getenv("WINDY_ENSEMBLE_MODELS", "gfs,ecmwf,icon").split(",") if m.strip()]
+
+forecast_store = ForecastStore(os.getenv("FORECAST_STORE_PATH", "data/forecast_store.db"))
+
+RISK_TILES_DIR = os.getenv("RISK_TILES_DIR", "data/risk_tiles")
+tile_server = TileServer(RISK_TILES_DIR, max_zoom=int(os.getenv("RISK_TILES_MAX_ZOOM", "10")))
+tile_build_lock = threading.Lock()
+
+# Identical concurrent requests (e.g. right after an alert) share one upstream fetch + prediction.
+# A leader shed at its own priority does not fail its followers; they retry at theirs
+inflight = SingleFlight(retry_on=(AdmissionRejected,))
+# Longest a coalesced follower waits for its leader's result before it is shed with a 503
+COALESCE_MAX_WAIT = float(os.getenv("COALESCE_MAX_WAIT_SECONDS", "60"))
+
+# Cost-aware admission for prediction endpoints: cost = upstream forecast fetches per request
+admission = AdmissionController.from_env(capacity=int(os.getenv("ADMISSION_CAPACITY", "4")))
+
 # --- DATA MODELS FOR REQUESTS ---
 class RegionalRequest(BaseModel):
     location: str
@@ -49,11 +84,16 @@ class CoordsRequest(BaseModel):
     lat: float
     lon: float
 
+class TrendRequest(BaseModel):
+    location: Optional[str] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    days: int = 30
+
 # --- HELPER FUNCTIONS ---
-def get_windy_forecast(lat, lon):
-    api_url = "https://api.windy.com/api/point-forecast/v2"
-    payload = {"lat": lat, "lon": lon, "model": "gfs", "parameters": ["precip"], "levels": ["surface"], "key": WINDY_API_KEY}
-    response = requests.post(api_url, json=payload)
+def get_windy_forecast(lat, lon, forecast_model="gfs"):
+    payload = {"lat": lat, "lon": lon, "model": forecast_model, "parameters": ["precip"], "levels": ["surface"], "key": WINDY_API_KEY}
+    response = requests.post(WINDY_API_URL, json=payload)
     response.raise_for_status()
     return response.json()
 
@@ -64,30 +104,33 @@ def get_risk_level(probability: float):
     elif prob_percent >= 40: return "Low Risk"
     else: return "No Significant Risk"
 
-def process_and_predict(forecast_data):
-    timestamps = pd.to_datetime(forecast_data['ts'], unit='ms')
+def score_features(features_df):
+    analysis_df = features_df.copy()
+    probabilities = model.predict_proba(analysis_df[FEATURE_COLS])[:, 1]
+    analysis_df['confidence'] = probabilities
+    analysis_df['risk_level'] = analysis_df['confidence'].apply(get_risk_level)
+    
+    analysis_df.reset_index(inplace=True)
+    analysis_df['date'] = analysis_df['date'].dt.strftime('%Y-%m-%d')
+    return analysis_df
+
+def process_and_predict(forecast_data, lat, lon):
     precip_data = forecast_data.get('past3hprecip-surface', [])
     
     if not precip_data: return None, []
 
-    hourly_df = pd.DataFrame({'date': timestamps, 'precip_mm': precip_data}).set_index('date')
-    daily_df = hourly_df.resample('D').sum()
-    daily_df['rainfall_mm'] = daily_df['precip_mm']
-    daily_df['rainfall_3_day_sum'] = daily_df['rainfall_mm'].rolling(window=3, min_periods=1).sum()
-    daily_df['rainfall_7_day_sum'] = daily_df['rainfall_mm'].rolling(window=7, min_periods=1).sum()
+    # Append this run to the location's history; rolling features are updated incrementally
+    series = series_key(lat, lon)
+    forecast_store.ingest(series, forecast_data['ts'], precip_data)
 
-    today = pd.to_datetime(datetime.utcnow()).normalize()
-    analysis_df = daily_df[daily_df.index > today].copy()
+    tomorrow = pd.to_datetime(datetime.utcnow()).normalize() + timedelta(days=1)
+    features_df = forecast_store.features(series, tomorrow.strftime('%Y-%m-%d'))
     
-    if analysis_df.empty: return None, []
+    if features_df.empty: return None, []
 
-    feature_cols = ['rainfall_mm', 'rainfall_3_day_sum', 'rainfall_7_day_sum']
-    probabilities = model.predict_proba(analysis_df[feature_cols])[:, 1]
-    analysis_df['confidence'] = probabilities
-    analysis_df['risk_level'] = analysis_df['confidence'].apply(get_risk_level)
-    
-    analysis_df.reset_index(inplace=True)
-    analysis_df['date'] = analysis_df['date'].dt.strftime('%Y-%m-%d')
+    return summarize_forecast(score_features(features_df))
+
+def summarize_forecast(analysis_df):
     cols_to_return = ['date', 'rainfall_mm', 'confidence', 'risk_level']
     detailed_forecast = analysis_df[cols_to_return].round(4).to_dict(orient='records')
     
@@ -101,6 +144,92 @@ def process_and_predict(forecast_data):
         
     return main_prediction, detailed_forecast
 
+def ensemble_predict(lat, lon):
+    """
+    Fetch every ensemble member concurrently, score all members' feature rows in one
+    predict_proba call, and return the primary member's forecast with per-day ensemble
+    mean and spread. The primary is GFS, as for the single-model endpoints, or the first
+    configured member with data when GFS failed; it is reported as primary_member. Members
+    the upstream rejects or answers with a malformed body are left out and reported.
+    """
+    def fetch_member(forecast_model):
+        try:
+            forecast_data = get_windy_forecast(lat, lon, forecast_model)
+            precip_data = forecast_data.get('past3hprecip-surface', [])
+            if not precip_data:
+                return forecast_model, False
+            forecast_store.ingest(member_series_key(forecast_model, lat, lon), forecast_data['ts'], precip_data)
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError, AttributeError):
+            return forecast_model, False
+        return forecast_model, True
+
+    with ThreadPoolExecutor(max_workers=len(ENSEMBLE_MODELS)) as pool:
+        fetched = list(pool.map(fetch_member, ENSEMBLE_MODELS))
+    members = [m for m, ok in fetched if ok]
+    failed = [m for m, ok in fetched if not ok]
+
+    tomorrow = (pd.to_datetime(datetime.utcnow()).normalize() + timedelta(days=1)).strftime('%Y-%m-%d')
+    frames = []
+    for forecast_model in members:
+        features_df = forecast_store.features(member_series_key(forecast_model, lat, lon), tomorrow)
+        if not features_df.empty:
+            frames.append(features_df.assign(member=forecast_model))
+    if not frames:
+        return None, [], {"members": [], "primary_member": None, "failed_members": failed}
+
+    scored_df = score_features(pd.concat(frames))
+    spread = scored_df.groupby('date')['confidence'].agg(
+        ensemble_mean='mean', ensemble_spread=lambda c: c.std(ddof=0),
+        ensemble_min='min', ensemble_max='max', ensemble_members='count'
+    ).round(4)
+
+    scored_members = set(scored_df['member'])
+    primary_member = "gfs" if "gfs" in scored_members else next(m for m in ENSEMBLE_MODELS if m in scored_members)
+    main_prediction, detailed_forecast = summarize_forecast(scored_df[scored_df['member'] == primary_member])
+    for day in detailed_forecast:
+        day.update(spread.loc[day['date']].to_dict())
+        day['ensemble_members'] = int(day['ensemble_members'])
+        day['ensemble_risk_level'] = get_risk_level(day['ensemble_mean'])
+
+    ensemble_info = {"members": sorted(scored_members), "primary_member": primary_member, "failed_members": failed}
+    return main_prediction, detailed_forecast, ensemble_info
+
+def forecast_for_point(lat, lon):
+    """Fetch and score the forecast for a point, coalesced per snapped coordinate."""
+    def fetch_and_predict():
+        forecast_data = get_windy_forecast(lat, lon)
+        return process_and_predict(forecast_data, lat, lon)
+    return inflight.do("point", series_key(lat, lon), fetch_and_predict)
+
+def admit(request: Request, cost):
+    """Charge the caller's token bucket; returns the caller's priority class."""
+    api_key = request.headers.get("X-API-Key")
+    priority = admission.classify(api_key)
+    client = api_key if priority != PUBLIC else get_remote_address(request)
+    try:
+        admission.charge(client, priority, cost)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+    return priority
+
+async def run_admitted(priority, cost, fn, *args):
+    """
+    Run fn in an execution slot; raises AdmissionRejected when the queue is too long.
+    The queue wait happens on the event loop, so only admitted work takes a threadpool thread.
+    """
+    async with admission.async_slot(priority, cost):
+        return await run_in_threadpool(fn, *args)
+
+async def run_coalesced(kind, key, priority, cost, fn, *args):
+    """Coalesce identical requests, then admit only the leader; sheds with 503 + Retry-After."""
+    try:
+        return await inflight.do_async(kind, key, run_admitted, priority, cost, fn, *args, timeout=COALESCE_MAX_WAIT)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        retry_after = str(int(CLASS_LIMITS[priority]["max_wait"]))
+        raise HTTPException(status_code=503, detail="Server is overloaded, retry later", headers={"Retry-After": retry_after})
+
 # --- API ENDPOINTS ---
 @app.get("/")
 @limiter.limit("10/hour")
@@ -120,13 +249,20 @@ LOCATION_COORDS = {
     'Kolkata': {'lat': 22.57, 'lon': 88.36, 'state': 'West Bengal'},
 }
 
+# Prediction endpoints are admitted by AdmissionController instead of the flat per-IP limit. They are
+# async so that queued requests and coalesced followers wait on the event loop, not in threadpool threads
 @app.post("/predict_regional")
-@limiter.limit("10/hour")
-def predict_regional_risk(request: Request, req: RegionalRequest):
+async def predict_regional_risk(request: Request, req: RegionalRequest):
     selected_location = req.location
     if selected_location not in LOCATION_COORDS:
         raise HTTPException(status_code=404, detail=f"Location '{selected_location}' not supported.")
 
+    selected_state = LOCATION_COORDS[selected_location]['state']
+    cost = sum(1 for data in LOCATION_COORDS.values() if data['state'] == selected_state)
+    priority = admit(request, cost)
+    return await run_coalesced("regional", selected_location, priority, cost, compute_regional_risk, selected_location)
+
+def compute_regional_risk(selected_location):
     selected_state = LOCATION_COORDS[selected_location]['state']
     locations_to_process = {loc: data for loc, data in LOCATION_COORDS.items() if data['state'] == selected_state}
     
@@ -135,8 +271,7 @@ def predict_regional_risk(request: Request, req: RegionalRequest):
 
     for location, coords in locations_to_process.items():
         try:
-            forecast_data = get_windy_forecast(coords['lat'], coords['lon'])
-            main_pred, detailed_forecast = process_and_predict(forecast_data)
+            main_pred, detailed_forecast = forecast_for_point(coords['lat'], coords['lon'])
             
             summary = {"Location": location, **main_pred} if main_pred else {"Location": location, "Risk Level": "Error"}
             all_results.append(summary)
@@ -156,17 +291,138 @@ def predict_regional_risk(request: Request, req: RegionalRequest):
     }
 
 @app.post("/predict_by_coords")
-@limiter.limit("10/hour")
-def predict_risk_by_coords(request: Request, req: CoordsRequest):
+async def predict_risk_by_coords(request: Request, req: CoordsRequest):
+    priority = admit(request, 1)
     try:
-        forecast_data = get_windy_forecast(req.lat, req.lon)
-        main_prediction, detailed_forecast = process_and_predict(forecast_data)
+        # "coords" rather than "point": a point flight is only ever led from inside a held slot,
+        # so regional requests never wait on a leader that is itself queued for one
+        main_prediction, detailed_forecast = await run_coalesced(
+            "coords", series_key(req.lat, req.lon), priority, 1, forecast_for_point, req.lat, req.lon
+        )
         
         if main_prediction is None:
              return {"main_prediction": {"Risk Level": "No Future Data"}, "detailed_forecast": []}
 
         return {"main_prediction": main_prediction, "detailed_forecast": detailed_forecast}
+    except HTTPException:
+        raise
     except requests.exceptions.RequestException as e:
         raise HTTPException(status_code=502, detail=f"Error from Windy API: {e}")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An internal error occurred: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"An internal error occurred: {str(e)}")
+
+@app.post("/predict_ensemble")
+async def predict_ensemble_by_coords(request: Request, req: CoordsRequest):
+    cost = len(ENSEMBLE_MODELS)
+    priority = admit(request, cost)
+    try:
+        main_prediction, detailed_forecast, ensemble_info = await run_coalesced(
+            "ensemble", series_key(req.lat, req.lon), priority, cost, ensemble_predict, req.lat, req.lon
+        )
+        
+        if main_prediction is None:
+             return {"main_prediction": {"Risk Level": "No Future Data"}, "detailed_forecast": [], "ensemble": ensemble_info}
+
+        return {"main_prediction": main_prediction, "detailed_forecast": detailed_forecast, "ensemble": ensemble_info}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An internal error occurred: {str(e)}")
+
+@app.post("/risk_trend")
+@limiter.limit("10/hour")
+def risk_trend(request: Request, req: TrendRequest):
+    """Hindcast risk over the last `days` days from stored forecast history (no upstream calls)."""
+    if req.location is not None:
+        if req.location not in LOCATION_COORDS:
+            raise HTTPException(status_code=404, detail=f"Location '{req.location}' not supported.")
+        lat, lon = LOCATION_COORDS[req.location]['lat'], LOCATION_COORDS[req.location]['lon']
+    elif req.lat is not None and req.lon is not None:
+        lat, lon = req.lat, req.lon
+    else:
+        raise HTTPException(status_code=422, detail="Provide either 'location' or both 'lat' and 'lon'.")
+    if not 1 <= req.days <= 365:
+        raise HTTPException(status_code=422, detail="'days' must be between 1 and 365.")
+
+    today = pd.to_datetime(datetime.utcnow()).normalize()
+    start = (today - timedelta(days=req.days)).strftime('%Y-%m-%d')
+    features_df = forecast_store.features(series_key(lat, lon), start, today.strftime('%Y-%m-%d'))
+    if features_df.empty:
+        return {"trend": [], "days_with_history": 0}
+
+    analysis_df = score_features(features_df)
+    cols_to_return = ['date', 'rainfall_mm', 'rainfall_7_day_sum', 'confidence', 'risk_level']
+    return {
+        "trend": analysis_df[cols_to_return].round(4).to_dict(orient='records'),
+        "days_with_history": len(analysis_df)
+    }
+
+@app.get("/stats")
+@limiter.limit("10/hour")
+def get_stats(request: Request):
+    return {
+        "coalescing": inflight.stats(),
+        "admission": admission.get_stats(),
+        "traffic_recorder": traffic_recorder.get_stats() if traffic_recorder else None
+    }
+
+# --- RISK TILES ---
+def rebuild_risk_tiles():
+    """Evaluate the model over the India grid and publish new tiles; skipped if a build is already running."""
+    if not tile_build_lock.acquire(blocking=False):
+        return None
+    try:
+        return build_risk_grid(
+            model, get_windy_forecast, forecast_store, RISK_TILES_DIR,
+            step=float(os.getenv("RISK_GRID_STEP", "1.0")),
+        )
+    finally:
+        tile_build_lock.release()
+
+def _refresh_tiles_periodically(interval_hours: float):
+    while True:
+        try:
+            rebuild_risk_tiles()
+        except Exception as e:
+            print(f"Risk tile build failed: {e}")
+        time.sleep(interval_hours * 3600)
+
+@app.on_event("startup")
+def start_tile_refresh():
+    # GFS publishes a new run every 6 hours; set RISK_TILES_REFRESH_HOURS to follow it
+    interval = os.getenv("RISK_TILES_REFRESH_HOURS")
+    if interval:
+        threading.Thread(target=_refresh_tiles_periodically, args=(float(interval),), daemon=True).start()
+
+@app.post("/tiles/rebuild")
+@limiter.limit("10/hour")
+def trigger_tile_rebuild(request: Request, background_tasks: BackgroundTasks):
+    # A rebuild fetches a forecast for every grid cell, so only NDMA/admin keys may start one
+    if admission.classify(request.headers.get("X-API-Key")) != CRITICAL:
+        raise HTTPException(status_code=403, detail="Tile rebuilds require an NDMA or admin API key.")
+    if tile_build_lock.locked():
+        return {"status": "already_running"}
+    background_tasks.add_task(rebuild_risk_tiles)
+    return {"status": "scheduled"}
+
+@app.get("/tiles/meta")
+def get_tiles_meta():
+    meta = tile_server.meta()
+    if meta is None:
+        raise HTTPException(status_code=404, detail="No risk tiles have been built yet.")
+    return meta
+
+# Tiles are precomputed or cached static content, so they are not rate limited; only tiles over
+# India up to RISK_TILES_MAX_ZOOM exist. ETags let map clients revalidate cheaply
+@app.get("/tiles/{day}/{z}/{x}/{y}.png")
+def get_risk_tile(request: Request, day: int, z: int, x: int, y: int):
+    etag = tile_server.etag(day, z, x, y)
+    if etag is None:
+        raise HTTPException(status_code=404, detail="Tile not found.")
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=600"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    tile = tile_server.tile(day, z, x, y)
+    if tile is None:
+        raise HTTPException(status_code=404, detail="Tile not found.")
+    return Response(content=tile, media_type="image/png", headers=headers)
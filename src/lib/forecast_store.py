@@ -0,0 +1,126 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+import pandas as pd
+
+FEATURE_COLS = ['rainfall_mm', 'rainfall_3_day_sum', 'rainfall_7_day_sum']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS precip (
+    series TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    precip_mm REAL NOT NULL,
+    ingested_at INTEGER NOT NULL,
+    PRIMARY KEY (series, ts)
+);
+CREATE TABLE IF NOT EXISTS daily_features (
+    series TEXT NOT NULL,
+    date TEXT NOT NULL,
+    rainfall_mm REAL NOT NULL,
+    rainfall_3_day_sum REAL NOT NULL,
+    rainfall_7_day_sum REAL NOT NULL,
+    PRIMARY KEY (series, date)
+);
+"""
+
+
+def series_key(lat: float, lon: float) -> str:
+    """Store key for a location, snapped to ~1 km so nearby requests share history."""
+    return f"{lat:.2f},{lon:.2f}"
+
+
+def member_series_key(forecast_model: str, lat: float, lon: float) -> str:
+    """Store key for one ensemble member; GFS keeps the plain key so existing history carries over."""
+    key = series_key(lat, lon)
+    return key if forecast_model == "gfs" else f"{forecast_model}:{key}"
+
+
+def _date_str(day) -> str:
+    return day.strftime('%Y-%m-%d')
+
+
+class ForecastStore:
+    """
+    Append-only store of 3-hourly precipitation per location, with daily rolling
+    features maintained incrementally as new forecast runs arrive.
+
+    A newer run overwrites the 3-hourly values it covers; only the days touched by
+    the run (and the following 6, whose rolling sums depend on them) are recomputed.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def ingest(self, series: str, timestamps_ms: Iterable[int], precip_mm: Iterable[float]) -> int:
+        """Append one forecast run (Windy `ts` and `past3hprecip-surface`) and refresh its features."""
+        rows = [
+            (series, int(ts), float(value or 0.0))
+            for ts, value in zip(timestamps_ms, precip_mm)
+        ]
+        if not rows:
+            return 0
+        ingested_at = int(datetime.now(timezone.utc).timestamp() * 1000)
+        first_day = datetime.fromtimestamp(min(r[1] for r in rows) / 1000, timezone.utc).date()
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO precip (series, ts, precip_mm, ingested_at) VALUES (?, ?, ?, ?)",
+                [row + (ingested_at,) for row in rows]
+            )
+            self._refresh_features(series, first_day)
+        return len(rows)
+
+    def _refresh_features(self, series: str, first_day):
+        # Daily totals from the first touched day onwards, plus 6 days of context for the rolling sums
+        context_start = first_day - timedelta(days=6)
+        start_ms = int(datetime(first_day.year, first_day.month, first_day.day, tzinfo=timezone.utc).timestamp() * 1000)
+        daily = dict(self._conn.execute(
+            "SELECT date(ts / 1000, 'unixepoch') AS day, SUM(precip_mm) FROM precip "
+            "WHERE series = ? AND ts >= ? GROUP BY day",
+            (series, start_ms)
+        ).fetchall())
+        if not daily:
+            return
+        context = dict(self._conn.execute(
+            "SELECT date, rainfall_mm FROM daily_features WHERE series = ? AND date >= ? AND date < ?",
+            (series, _date_str(context_start), _date_str(first_day))
+        ).fetchall())
+
+        last_day = datetime.strptime(max(daily), '%Y-%m-%d').date()
+        window: List[float] = [context.get(_date_str(context_start + timedelta(days=i)), 0.0) for i in range(6)]
+        updates = []
+        day = first_day
+        while day <= last_day:
+            # Days without readings count as zero rainfall, as with a daily resample
+            rainfall = daily.get(_date_str(day), 0.0)
+            window = window[-6:] + [rainfall]
+            updates.append((series, _date_str(day), rainfall, sum(window[-3:]), sum(window)))
+            day += timedelta(days=1)
+
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO daily_features "
+            "(series, date, rainfall_mm, rainfall_3_day_sum, rainfall_7_day_sum) VALUES (?, ?, ?, ?, ?)",
+            updates
+        )
+
+    def features(self, series: str, start_date: str, end_date: Optional[str] = None) -> pd.DataFrame:
+        """Precomputed feature rows for `start_date` <= date (<= `end_date`), indexed by date."""
+        query = "SELECT date, rainfall_mm, rainfall_3_day_sum, rainfall_7_day_sum FROM daily_features WHERE series = ? AND date >= ?"
+        params = [series, start_date]
+        if end_date is not None:
+            query += " AND date <= ?"
+            params.append(end_date)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY date", params).fetchall()
+        df = pd.DataFrame(rows, columns=['date'] + FEATURE_COLS)
+        df['date'] = pd.to_datetime(df['date'])
+        return df.set_index('date')
@@ -0,0 +1,276 @@
+import json
+import math
+import os
+import shutil
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from forecast_store import FEATURE_COLS, ForecastStore, series_key
+
+# lat_min, lat_max, lon_min, lon_max
+INDIA_BOUNDS = (6.0, 38.0, 68.0, 98.0)
+TILE_SIZE = 256
+
+# Same thresholds as get_risk_level in floodPredictionAPI.py; below 0.4 stays transparent
+RISK_COLORS = [
+    (0.9, (239, 68, 68, 200)),   # High Risk
+    (0.7, (249, 115, 22, 180)),  # Medium Risk
+    (0.4, (250, 204, 21, 150)),  # Low Risk
+]
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """Minimal RGBA PNG encoder (no imaging dependency needed for flat-colour tiles)."""
+    height, width, _ = rgba.shape
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, width * 4)], axis=1)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)) + chunk(b"IEND", b""))
+
+
+def tile_lat_lon(z: int, x: int, y: int):
+    """Latitude/longitude of every pixel centre in a Web Mercator XYZ tile."""
+    n = 2 ** z
+    offsets = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+    lon = (x + offsets) / n * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + offsets) / n))))
+    return np.meshgrid(lat, lon, indexing="ij")
+
+
+def tile_range(z: int, bounds=INDIA_BOUNDS):
+    """XYZ tile x/y ranges covering the bounding box at zoom z."""
+    lat_min, lat_max, lon_min, lon_max = bounds
+    n = 2 ** z
+
+    def to_x(lon):
+        return int((lon + 180.0) / 360.0 * n)
+
+    def to_y(lat):
+        rad = math.radians(lat)
+        return int((1 - math.log(math.tan(rad) + 1 / math.cos(rad)) / math.pi) / 2 * n)
+
+    return range(to_x(lon_min), min(to_x(lon_max), n - 1) + 1), range(to_y(lat_max), min(to_y(lat_min), n - 1) + 1)
+
+
+def render_tile(grid: np.ndarray, meta: Dict, z: int, x: int, y: int) -> bytes:
+    """Bilinearly sample one day's probability grid onto a tile and colour it by risk level."""
+    lat, lon = tile_lat_lon(z, x, y)
+    step = meta["step"]
+    lat_min, _, lon_min, _ = meta["bounds"]
+    rows, cols = grid.shape
+
+    fr = (lat - lat_min) / step
+    fc = (lon - lon_min) / step
+    inside = (fr >= 0) & (fr <= rows - 1) & (fc >= 0) & (fc <= cols - 1)
+    r0 = np.clip(np.floor(fr).astype(int), 0, rows - 1)
+    c0 = np.clip(np.floor(fc).astype(int), 0, cols - 1)
+    r1 = np.minimum(r0 + 1, rows - 1)
+    c1 = np.minimum(c0 + 1, cols - 1)
+    wr = fr - r0
+    wc = fc - c0
+    top = grid[r0, c0] * (1 - wc) + grid[r0, c1] * wc
+    bottom = grid[r1, c0] * (1 - wc) + grid[r1, c1] * wc
+    probability = np.where(inside, top * (1 - wr) + bottom * wr, np.nan)
+
+    rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    assigned = np.zeros((TILE_SIZE, TILE_SIZE), dtype=bool)
+    with np.errstate(invalid="ignore"):
+        for threshold, color in RISK_COLORS:
+            mask = (probability >= threshold) & ~assigned
+            rgba[mask] = color
+            assigned |= mask
+    return encode_png(rgba)
+
+
+def build_risk_grid(model, fetch_forecast: Callable, store: ForecastStore, out_dir: str,
+                    step: float = 1.0, zooms=range(3, 8), max_workers: int = 8,
+                    keep_runs: int = 2) -> Dict:
+    """
+    Evaluate the model over a regular grid covering India and publish the result.
+
+    Forecasts are fetched concurrently and appended to the forecast store; all cells'
+    feature rows are then scored in one predict_proba call. Output per run:
+      grid.npy   float32 [day, row, col] probabilities, row 0 = southern edge (np.load(mmap_mode='r'))
+      grid.json  bounds, step, dates
+      tiles/{day}/{z}/{x}/{y}.png for the pre-rendered zoom levels
+    current.json is switched atomically once the run is complete.
+    """
+    lat_min, lat_max, lon_min, lon_max = INDIA_BOUNDS
+    lats = np.round(np.arange(lat_min, lat_max + step / 2, step), 4)
+    lons = np.round(np.arange(lon_min, lon_max + step / 2, step), 4)
+    cells = [(r, c, float(lat), float(lon)) for r, lat in enumerate(lats) for c, lon in enumerate(lons)]
+
+    def ingest_cell(cell):
+        _, _, lat, lon = cell
+        try:
+            forecast_data = fetch_forecast(lat, lon)
+        except Exception:
+            return False
+        precip = forecast_data.get('past3hprecip-surface', [])
+        if not precip:
+            return False
+        store.ingest(series_key(lat, lon), forecast_data['ts'], precip)
+        return True
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        fetched = list(pool.map(ingest_cell, cells))
+
+    tomorrow = (pd.to_datetime(datetime.utcnow()).normalize() + timedelta(days=1)).strftime('%Y-%m-%d')
+    frames = []
+    for (r, c, lat, lon), ok in zip(cells, fetched):
+        if not ok:
+            continue
+        features = store.features(series_key(lat, lon), tomorrow)
+        if features.empty:
+            continue
+        frames.append(features.assign(row=r, col=c))
+    if not frames:
+        raise RuntimeError("No forecast data available for any grid cell.")
+
+    # One vectorized scoring pass over every (cell, day) row
+    features_df = pd.concat(frames).reset_index()
+    features_df['probability'] = model.predict_proba(features_df[FEATURE_COLS])[:, 1]
+    dates = sorted(features_df['date'].dt.strftime('%Y-%m-%d').unique())
+    day_index = {date: i for i, date in enumerate(dates)}
+
+    grid = np.full((len(dates), len(lats), len(lons)), np.nan, dtype=np.float32)
+    grid[
+        features_df['date'].dt.strftime('%Y-%m-%d').map(day_index).to_numpy(),
+        features_df['row'].to_numpy(),
+        features_df['col'].to_numpy(),
+    ] = features_df['probability'].to_numpy(dtype=np.float32)
+
+    run_id = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    run_dir = os.path.join(out_dir, "runs", run_id)
+    os.makedirs(run_dir, exist_ok=True)
+    meta = {
+        "run_id": run_id,
+        "bounds": list(INDIA_BOUNDS),
+        "step": step,
+        "shape": list(grid.shape),
+        "dates": dates,
+        "cells_with_data": int(sum(fetched)),
+        "cells_total": len(cells),
+        "prerendered_zooms": list(zooms),
+    }
+    np.save(os.path.join(run_dir, "grid.npy"), grid)
+    with open(os.path.join(run_dir, "grid.json"), "w") as f:
+        json.dump(meta, f)
+
+    for day in range(len(dates)):
+        for z in zooms:
+            xs, ys = tile_range(z)
+            for x in xs:
+                tile_dir = os.path.join(run_dir, "tiles", str(day), str(z), str(x))
+                os.makedirs(tile_dir, exist_ok=True)
+                for y in ys:
+                    with open(os.path.join(tile_dir, f"{y}.png"), "wb") as f:
+                        f.write(render_tile(grid[day], meta, z, x, y))
+
+    current_tmp = os.path.join(out_dir, "current.json.tmp")
+    with open(current_tmp, "w") as f:
+        json.dump({"run_id": run_id}, f)
+    os.replace(current_tmp, os.path.join(out_dir, "current.json"))
+
+    runs = sorted(os.listdir(os.path.join(out_dir, "runs")))
+    for old in runs[:-keep_runs]:
+        shutil.rmtree(os.path.join(out_dir, "runs", old), ignore_errors=True)
+    return meta
+
+
+class TileServer:
+    """
+    Serves published tiles; picks up a new run as soon as current.json changes.
+
+    Only tiles overlapping India up to max_zoom exist. Those above the pre-rendered zooms are
+    rendered once from the mmap'd grid and kept in an LRU cache, so repeat viewers cost nothing.
+    """
+
+    def __init__(self, out_dir: str, max_zoom: int = 10, cache_size: int = 4096):
+        self.out_dir = out_dir
+        self.max_zoom = max_zoom
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._run_id = None
+        self._meta = None
+        self._grid = None
+        self._rendered = OrderedDict()  # (run_id, day, z, x, y) -> PNG bytes
+
+    def _load(self):
+        """The current run's (meta, grid), read together under the lock; (None, None) before the first run."""
+        try:
+            with open(os.path.join(self.out_dir, "current.json")) as f:
+                run_id = json.load(f)["run_id"]
+        except (OSError, ValueError, KeyError):
+            return None, None
+        with self._lock:
+            if run_id != self._run_id:
+                run_dir = os.path.join(self.out_dir, "runs", run_id)
+                with open(os.path.join(run_dir, "grid.json")) as f:
+                    self._meta = json.load(f)
+                self._grid = np.load(os.path.join(run_dir, "grid.npy"), mmap_mode="r")
+                self._run_id = run_id
+                self._rendered.clear()
+            return self._meta, self._grid
+
+    def meta(self) -> Optional[Dict]:
+        return self._load()[0]
+
+    def _exists(self, meta: Optional[Dict], day: int, z: int, x: int, y: int) -> bool:
+        if meta is None or not 0 <= day < len(meta["dates"]) or not 0 <= z <= self.max_zoom:
+            return False
+        xs, ys = tile_range(z, meta["bounds"])
+        return x in xs and y in ys
+
+    def tile(self, day: int, z: int, x: int, y: int) -> Optional[bytes]:
+        """PNG bytes for a tile, from disk when pre-rendered, otherwise rendered from the mmap'd grid once."""
+        meta, grid = self._load()
+        if not self._exists(meta, day, z, x, y):
+            return None
+        path = os.path.join(self.out_dir, "runs", meta["run_id"], "tiles", str(day), str(z), str(x), f"{y}.png")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return f.read()
+
+        key = (meta["run_id"], day, z, x, y)
+        with self._lock:
+            if key in self._rendered:
+                self._rendered.move_to_end(key)
+                return self._rendered[key]
+        tile = render_tile(np.asarray(grid[day]), meta, z, x, y)
+        with self._lock:
+            # A run published while rendering has already cleared the cache; do not refill it with the old run
+            if self._run_id == meta["run_id"]:
+                self._rendered[key] = tile
+                if len(self._rendered) > self.cache_size:
+                    self._rendered.popitem(last=False)
+        return tile
+
+    def etag(self, day: int, z: int, x: int, y: int) -> Optional[str]:
+        """ETag of an existing tile; None when the tile does not exist."""
+        meta, _ = self._load()
+        if not self._exists(meta, day, z, x, y):
+            return None
+        return f'"{meta["run_id"]}-{day}-{z}-{x}-{y}"'
+
+
+if __name__ == "__main__":
+    from floodPredictionAPI import forecast_store, get_windy_forecast, model
+
+    result = build_risk_grid(
+        model, get_windy_forecast, forecast_store, os.getenv("RISK_TILES_DIR", "data/risk_tiles"),
+        step=float(os.getenv("RISK_GRID_STEP", "1.0")),
+    )
+    print(json.dumps({k: v for k, v in result.items() if k != "dates"}, indent=2))
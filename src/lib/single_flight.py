@@ -0,0 +1,136 @@
+import asyncio
+import threading
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, Type
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = []  # (loop, future) of async followers
+
+    def finish(self):
+        """Wake every follower; caller holds the SingleFlight lock"""
+        self.done.set()
+        for loop, future in self.waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls into one execution.
+
+    The first caller for a key runs the function; callers arriving while it is in
+    flight wait and receive the same result (or exception). Nothing is cached once
+    the call completes, so freshness is unchanged.
+
+    Exceptions listed in `retry_on` belong to the leader alone (e.g. its admission was
+    shed at its priority): followers do not inherit them but retry, one becoming the new leader.
+
+    do_async() is the same for coroutine functions: followers wait on the event loop rather
+    than in a thread, for at most `timeout` seconds (asyncio.TimeoutError after that).
+    """
+
+    def __init__(self, retry_on: Tuple[Type[BaseException], ...] = ()):
+        self.retry_on = retry_on
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._stats = defaultdict(lambda: {"requests": 0, "executions": 0, "coalesced": 0, "retried": 0, "timed_out": 0})
+
+    def do(self, kind: str, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        flight_key = (kind, key)
+        with self._lock:
+            self._stats[kind]["requests"] += 1
+        while True:
+            with self._lock:
+                stats = self._stats[kind]
+                call = self._calls.get(flight_key)
+                if call is not None:
+                    stats["coalesced"] += 1
+                    leader = False
+                else:
+                    call = self._calls[flight_key] = _Call()
+                    stats["executions"] += 1
+                    leader = True
+
+            if leader:
+                break
+            call.done.wait()
+            if call.error is None:
+                return call.result
+            if not isinstance(call.error, self.retry_on):
+                raise call.error
+            with self._lock:
+                stats["retried"] += 1
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[flight_key]
+                call.finish()
+
+    async def do_async(self, kind: str, key: Hashable, fn: Callable[..., Awaitable[Any]], *args,
+                       timeout: Optional[float] = None, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        flight_key = (kind, key)
+        with self._lock:
+            self._stats[kind]["requests"] += 1
+        while True:
+            with self._lock:
+                stats = self._stats[kind]
+                call = self._calls.get(flight_key)
+                if call is not None:
+                    stats["coalesced"] += 1
+                    leader = False
+                    done = loop.create_future()
+                    call.waiters.append((loop, done))
+                else:
+                    call = self._calls[flight_key] = _Call()
+                    stats["executions"] += 1
+                    leader = True
+
+            if leader:
+                break
+            try:
+                await asyncio.wait_for(done, timeout)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    stats["timed_out"] += 1
+                raise
+            if call.error is None:
+                return call.result
+            # A cancelled leader (its client went away) is no reason to fail the followers either
+            if not isinstance(call.error, self.retry_on + (asyncio.CancelledError,)):
+                raise call.error
+            with self._lock:
+                stats["retried"] += 1
+
+        try:
+            call.result = await fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[flight_key]
+                call.finish()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "by_kind": {kind: dict(values) for kind, values in self._stats.items()},
+            }
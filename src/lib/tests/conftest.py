@@ -0,0 +1,31 @@
+import importlib
+import os
+import sys
+
+import joblib
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class RainfallModel:
+    """Deterministic stand-in for the trained classifier: probability rises with 7-day rainfall."""
+
+    def predict_proba(self, features):
+        probability = 1 / (1 + np.exp(-(features['rainfall_7_day_sum'].to_numpy() - 20) / 5))
+        return np.column_stack([1 - probability, probability])
+
+
+@pytest.fixture(scope="session")
+def flood_api(tmp_path_factory):
+    """floodPredictionAPI with a temporary forecast store and the RainfallModel."""
+    data_dir = tmp_path_factory.mktemp("flood_api")
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("WINDY_API", "test")
+        patch.setenv("FORECAST_STORE_PATH", str(data_dir / "forecast_store.db"))
+        patch.setenv("RISK_TILES_DIR", str(data_dir / "risk_tiles"))
+        patch.setattr(joblib, "load", lambda path: RainfallModel())
+        sys.modules.pop("floodPredictionAPI", None)
+        module = importlib.import_module("floodPredictionAPI")
+    return module
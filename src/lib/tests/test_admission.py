@@ -0,0 +1,122 @@
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import windy_stub
+from admission import CRITICAL, PUBLIC, AdmissionController, AdmissionRejected
+from single_flight import SingleFlight
+
+
+def test_shed_leader_does_not_fail_critical_follower():
+    admission = AdmissionController(capacity=1)
+    admission._seconds_per_unit = 0.001  # queue looks short, so the public leader queues instead of being shed upfront
+    inflight = SingleFlight(retry_on=(AdmissionRejected,))
+    results = {}
+
+    def run_admitted(priority):
+        with admission.slot(priority, 1):
+            time.sleep(0.1)
+            return "forecast"
+
+    def call(name, priority):
+        try:
+            results[name] = inflight.do("point", "16.70,74.24", run_admitted, priority)
+        except AdmissionRejected as e:
+            results[name] = e.status_code
+
+    with admission.slot(CRITICAL, 1):
+        # The slot is busy past the public class's max wait, so the public leader is shed
+        public = threading.Thread(target=call, args=("public", PUBLIC))
+        public.start()
+        time.sleep(0.2)
+        critical = threading.Thread(target=call, args=("critical", CRITICAL))
+        critical.start()
+        public.join()
+
+    critical.join()
+    assert results == {"public": 503, "critical": "forecast"}
+    assert inflight.stats()["by_kind"]["point"]["retried"] == 1
+
+
+@pytest.fixture
+def stub_windy(flood_api, monkeypatch):
+    calls = []
+
+    def get_windy_forecast(lat, lon, forecast_model="gfs"):
+        calls.append((lat, lon, forecast_model))
+        time.sleep(0.2)
+        return windy_stub.point_forecast(windy_stub.PointForecastRequest(lat=lat, lon=lon, model=forecast_model))
+
+    monkeypatch.setattr(flood_api, "get_windy_forecast", get_windy_forecast)
+    monkeypatch.setattr(flood_api, "admission", AdmissionController(capacity=1, api_keys={"ndma-key": "ndma"}))
+    monkeypatch.setattr(flood_api, "inflight", SingleFlight(retry_on=(AdmissionRejected,)))
+    return calls
+
+
+def test_identical_coordinate_requests_share_one_slot_and_fetch(flood_api, stub_windy):
+    statuses = []
+
+    with TestClient(flood_api.app) as client:
+        def request():
+            response = client.post("/predict_by_coords", json={"lat": 26.85, "lon": 80.95}, headers={"X-API-Key": "ndma-key"})
+            statuses.append(response.status_code)
+
+        threads = [threading.Thread(target=request) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert statuses == [200] * 5
+    assert len(stub_windy) == 1
+    stats = flood_api.inflight.stats()["by_kind"]["coords"]
+    assert stats["executions"] == 1 and stats["coalesced"] == 4
+    assert flood_api.admission.get_stats()["by_class"]["critical"]["admitted"] == 1
+
+
+def test_critical_request_is_not_starved_by_a_follower_stampede(flood_api, stub_windy, monkeypatch):
+    # More identical NGO requests than the server has threadpool threads (40), one key each
+    ngo_keys = {f"ngo-key-{i}": "ngo" for i in range(60)}
+    monkeypatch.setattr(flood_api, "admission", AdmissionController(capacity=2, api_keys={**ngo_keys, "ndma-key": "ndma"}))
+    statuses = []
+
+    with TestClient(flood_api.app) as client:
+        def regional(api_key):
+            response = client.post("/predict_regional", json={"location": "Kolhapur"}, headers={"X-API-Key": api_key})
+            statuses.append(response.status_code)
+
+        stampede = [threading.Thread(target=regional, args=(key,)) for key in ngo_keys]
+        for thread in stampede:
+            thread.start()
+        time.sleep(0.1)
+
+        started = time.monotonic()
+        response = client.post("/predict_by_coords", json={"lat": 28.61, "lon": 77.21}, headers={"X-API-Key": "ndma-key"})
+        critical_latency = time.monotonic() - started
+
+        for thread in stampede:
+            thread.join()
+
+    assert response.status_code == 200
+    # One 0.2 s fetch, not a wait for the stampede's leader to fetch three Maharashtra points
+    assert critical_latency < 0.4
+    assert statuses == [200] * 60
+    assert flood_api.inflight.stats()["by_kind"]["regional"]["executions"] == 1
+
+
+def test_full_bucket_table_evicts_only_the_idlest_client():
+    admission = AdmissionController(max_buckets=3)
+    for _ in range(10):
+        admission.charge("203.0.113.7", PUBLIC, 1)
+    admission.charge("198.51.100.1", PUBLIC, 1)
+    admission.charge("198.51.100.2", PUBLIC, 1)
+    with pytest.raises(AdmissionRejected):
+        admission.charge("203.0.113.7", PUBLIC, 1)
+
+    # A new client fills the table: 198.51.100.1 is evicted, the drained bucket is kept
+    admission.charge("198.51.100.3", PUBLIC, 1)
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.charge("203.0.113.7", PUBLIC, 1)
+    assert rejected.value.status_code == 429
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+import requests
+from fastapi import HTTPException
+
+import windy_stub
+from forecast_store import member_series_key
+
+from conftest import RainfallModel
+
+
+@pytest.fixture
+def stub_upstream(flood_api, monkeypatch):
+    """Route Windy calls to windy_stub; `failures` maps a model to the exception its fetch raises."""
+    failures = {}
+
+    def get_windy_forecast(lat, lon, forecast_model="gfs"):
+        if forecast_model in failures:
+            raise failures[forecast_model]
+        request = windy_stub.PointForecastRequest(lat=lat, lon=lon, model=forecast_model)
+        try:
+            return windy_stub.point_forecast(request)
+        except HTTPException as e:
+            raise requests.exceptions.HTTPError(f"{e.status_code} {e.detail}")
+
+    monkeypatch.setattr(flood_api, "get_windy_forecast", get_windy_forecast)
+    monkeypatch.setattr(flood_api, "ENSEMBLE_MODELS", ["gfs", "ecmwf", "icon"])
+    return failures
+
+
+def member_probabilities(flood_api, forecast_model, lat, lon, dates):
+    features = flood_api.forecast_store.features(member_series_key(forecast_model, lat, lon), min(dates), max(dates))
+    return dict(zip(features.index.strftime('%Y-%m-%d'), RainfallModel().predict_proba(features)[:, 1]))
+
+
+def test_ensemble_mean_spread_and_members(flood_api, stub_upstream):
+    lat, lon = 16.70, 74.24
+    main_prediction, detailed_forecast, ensemble = flood_api.ensemble_predict(lat, lon)
+
+    assert ensemble == {"members": ["ecmwf", "gfs", "icon"], "primary_member": "gfs", "failed_members": []}
+    assert main_prediction is not None and detailed_forecast
+
+    dates = [day['date'] for day in detailed_forecast]
+    per_member = [member_probabilities(flood_api, m, lat, lon, dates) for m in ("gfs", "ecmwf", "icon")]
+    for day in detailed_forecast:
+        values = [member[day['date']] for member in per_member]
+        assert day['ensemble_members'] == 3
+        assert day['ensemble_mean'] == pytest.approx(np.mean(values), abs=1e-4)
+        assert day['ensemble_spread'] == pytest.approx(np.std(values), abs=1e-4)
+        assert day['ensemble_min'] == pytest.approx(min(values), abs=1e-4)
+        assert day['ensemble_max'] == pytest.approx(max(values), abs=1e-4)
+        assert day['ensemble_risk_level'] == flood_api.get_risk_level(day['ensemble_mean'])
+        # The headline forecast stays the GFS member's
+        assert day['confidence'] == pytest.approx(per_member[0][day['date']], abs=1e-4)
+
+
+def test_failed_and_malformed_members_are_reported(flood_api, stub_upstream):
+    stub_upstream["ecmwf"] = ValueError("Expecting value: line 1 column 1 (char 0)")
+    stub_upstream["icon"] = requests.exceptions.ConnectionError("upstream unavailable")
+
+    _, detailed_forecast, ensemble = flood_api.ensemble_predict(19.08, 72.88)
+
+    assert ensemble == {"members": ["gfs"], "primary_member": "gfs", "failed_members": ["ecmwf", "icon"]}
+    for day in detailed_forecast:
+        assert day['ensemble_members'] == 1
+        assert day['ensemble_spread'] == 0
+        assert day['ensemble_mean'] == pytest.approx(day['confidence'], abs=1e-4)
+
+
+def test_failed_gfs_falls_back_to_the_next_configured_member(flood_api, stub_upstream):
+    lat, lon = 22.57, 88.36
+    stub_upstream["gfs"] = requests.exceptions.HTTPError("502 Bad Gateway")
+
+    _, detailed_forecast, ensemble = flood_api.ensemble_predict(lat, lon)
+
+    assert ensemble == {"members": ["ecmwf", "icon"], "primary_member": "ecmwf", "failed_members": ["gfs"]}
+    dates = [day['date'] for day in detailed_forecast]
+    ecmwf = member_probabilities(flood_api, "ecmwf", lat, lon, dates)
+    for day in detailed_forecast:
+        assert day['confidence'] == pytest.approx(ecmwf[day['date']], abs=1e-4)
+
+
+def test_model_rejected_by_upstream_is_a_failed_member(flood_api, stub_upstream, monkeypatch):
+    monkeypatch.setattr(windy_stub, "MODELS", ["gfs", "ecmwf"])
+
+    _, _, ensemble = flood_api.ensemble_predict(13.08, 80.27)
+
+    assert ensemble == {"members": ["ecmwf", "gfs"], "primary_member": "gfs", "failed_members": ["icon"]}
+
+
+def test_no_members_available(flood_api, stub_upstream):
+    for forecast_model in ("gfs", "ecmwf", "icon"):
+        stub_upstream[forecast_model] = requests.exceptions.Timeout("timed out")
+
+    assert flood_api.ensemble_predict(28.61, 77.21) == (
+        None, [], {"members": [], "primary_member": None, "failed_members": ["gfs", "ecmwf", "icon"]}
+    )
@@ -0,0 +1,45 @@
+import json
+
+import numpy as np
+
+import risk_tiles
+from risk_tiles import INDIA_BOUNDS, TileServer, tile_range
+
+
+def publish(out_dir, run_id, days, probability):
+    """Write a run the way build_risk_grid does, without pre-rendered tiles, and make it current."""
+    run_dir = out_dir / "runs" / run_id
+    run_dir.mkdir(parents=True)
+    grid = np.full((days, 33, 31), probability, dtype=np.float32)
+    np.save(run_dir / "grid.npy", grid)
+    meta = {"run_id": run_id, "bounds": list(INDIA_BOUNDS), "step": 1.0, "shape": list(grid.shape),
+            "dates": [f"2026-07-{day + 1:02d}" for day in range(days)], "prerendered_zooms": []}
+    (run_dir / "grid.json").write_text(json.dumps(meta))
+    (out_dir / "current.json").write_text(json.dumps({"run_id": run_id}))
+
+
+def test_tile_renders_from_the_run_it_was_checked_against(tmp_path, monkeypatch):
+    publish(tmp_path, "20260701T000000Z", days=3, probability=0.95)
+    server = TileServer(str(tmp_path))
+    xs, ys = tile_range(8)
+    x, y = xs[len(xs) // 2], ys[len(ys) // 2]
+    rendered = []
+
+    def exists_then_publish(meta, *tile):
+        # A rebuild publishes a one-day run between the existence check and the render
+        if not (tmp_path / "runs" / "20260701T060000Z").exists():
+            publish(tmp_path, "20260701T060000Z", days=1, probability=0.1)
+            server._load()
+        return TileServer._exists(server, meta, *tile)
+
+    def record_render(grid, meta, *tile):
+        rendered.append((meta["run_id"], float(grid.max())))
+        return b"png"
+
+    monkeypatch.setattr(server, "_exists", exists_then_publish)
+    monkeypatch.setattr(risk_tiles, "render_tile", record_render)
+
+    assert server.tile(2, 8, x, y) == b"png"
+    assert rendered == [("20260701T000000Z", np.float32(0.95))]
+    # Not cached under the old run either
+    assert server.tile(2, 8, x, y) is None
@@ -0,0 +1,16 @@
+import os
+
+import pytest
+
+LIB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+XVIEW2_DIR = os.path.join(os.path.dirname(os.path.dirname(LIB_DIR)), "xview2-model")
+
+
+@pytest.mark.parametrize("module", ["admission.py", "traffic_recorder.py"])
+def test_service_copies_are_identical(module):
+    """Both services ship their own copy; a fix applied to one copy must be applied to both."""
+    with open(os.path.join(LIB_DIR, module), "rb") as f:
+        flood_copy = f.read()
+    with open(os.path.join(XVIEW2_DIR, module), "rb") as f:
+        damage_copy = f.read()
+    assert flood_copy == damage_copy, f"src/lib/{module} and xview2-model/{module} have diverged"
@@ -0,0 +1,166 @@
+"""
+Traffic Recorder
+Optional ASGI middleware that logs anonymised request metadata as compact JSONL for load replay
+
+Kept identical in xview2-model/ and src/lib/ because each service is built from its own
+directory; src/lib/tests/test_shared_modules.py fails if the copies drift
+"""
+
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+COORDINATE_KEYS = {"lat", "lon", "latitude", "longitude"}
+# Never written to the log, whatever the endpoint
+DROPPED_KEYS = {"user_id", "key", "api_key", "email", "phone", "name", "address"}
+MAX_STRING = 64
+MAX_JSON_BODY = 64 * 1024
+
+
+def scrub(fields: Dict[str, Any], coordinate_decimals: int = 2) -> Dict[str, Any]:
+    """Keep only replayable scalars: coordinates rounded, identifiers and long strings dropped"""
+    clean = {}
+    for key, value in fields.items():
+        if key in DROPPED_KEYS or value is None:
+            continue
+        if key in COORDINATE_KEYS and isinstance(value, (int, float)):
+            clean[key] = round(float(value), coordinate_decimals)
+        elif isinstance(value, (bool, int, float)):
+            clean[key] = value
+        elif isinstance(value, str) and len(value) <= MAX_STRING:
+            clean[key] = value
+    return clean
+
+
+def annotate(request, **fields):
+    """Attach fields to the current request's log entry; a no-op when recording is off"""
+    entry = request.scope.get("traffic")
+    if entry is not None:
+        entry.update(fields)
+
+
+class TrafficRecorder:
+    """
+    Appends one line per request: arrival time, method, path, status, latency, request
+    and response sizes, plus anonymised JSON body fields and whatever endpoints annotate
+    (e.g. upload dimensions). No client addresses, headers, query strings or payloads
+    """
+
+    def __init__(self, path: str, sample_rate: float = 1.0, coordinate_decimals: int = 2,
+                 max_bytes: int = 100 * 1024 * 1024, salt: Optional[str] = None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.sample_rate = sample_rate
+        self.coordinate_decimals = coordinate_decimals
+        self.max_bytes = max_bytes
+        # Content tokens only match within logs sharing a salt, never against outside images
+        self._salt = (salt or os.urandom(16).hex()).encode()
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1)
+        self.recorded = 0
+        self.dropped = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["TrafficRecorder"]:
+        """Build from TRAFFIC_RECORD_PATH; returns None (recording off) when it is unset"""
+        path = os.environ.get("TRAFFIC_RECORD_PATH")
+        if not path:
+            return None
+        return cls(
+            path,
+            sample_rate=float(os.environ.get("TRAFFIC_SAMPLE_RATE", "1.0")),
+            coordinate_decimals=int(os.environ.get("TRAFFIC_COORD_DECIMALS", "2")),
+            max_bytes=int(float(os.environ.get("TRAFFIC_RECORD_MAX_MB", "100")) * 1024 * 1024),
+            salt=os.environ.get("TRAFFIC_RECORD_SALT")
+        )
+
+    def content_token(self, data: bytes) -> str:
+        """Short salted digest so identical uploads can be replayed as identical synthetic ones"""
+        return hashlib.blake2b(data, digest_size=6, key=self._salt[:64]).hexdigest()
+
+    def write(self, entry: Dict[str, Any]):
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file.tell() + len(line) > self.max_bytes:
+                if self.dropped == 0:
+                    logger.warning(f"Traffic log {self.path} reached its size cap, no longer recording")
+                self.dropped += 1
+                return
+            self._file.write(line)
+            self.recorded += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "sample_rate": self.sample_rate,
+                "recorded": self.recorded, "dropped": self.dropped}
+
+
+class TrafficRecorderMiddleware:
+    """app.add_middleware(TrafficRecorderMiddleware, recorder=recorder)"""
+
+    def __init__(self, app, recorder: TrafficRecorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or random.random() >= self.recorder.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        arrival = time.time()
+        started = time.perf_counter()
+        headers = dict(scope.get("headers") or [])
+        is_json = headers.get(b"content-type", b"").startswith(b"application/json")
+        scope["traffic"] = annotations = {}
+        body = []
+        sizes = {"in": 0, "out": 0, "status": 500}
+
+        async def recording_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                sizes["in"] += len(chunk)
+                if is_json and sizes["in"] <= MAX_JSON_BODY:
+                    body.append(chunk)
+            return message
+
+        async def recording_send(message):
+            if message["type"] == "http.response.start":
+                sizes["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["out"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, recording_receive, recording_send)
+        finally:
+            entry = {
+                "t": round(arrival, 3),
+                "m": scope["method"],
+                "p": scope["path"],
+                "s": sizes["status"],
+                "ms": round((time.perf_counter() - started) * 1000, 1),
+                "in": sizes["in"],
+                "out": sizes["out"]
+            }
+            if body and sizes["in"] <= MAX_JSON_BODY:
+                try:
+                    payload = json.loads(b"".join(body))
+                    if isinstance(payload, dict):
+                        entry["json"] = scrub(payload, self.recorder.coordinate_decimals)
+                except ValueError:
+                    pass
+            for key, value in annotations.items():
+                entry[key] = scrub(value, self.recorder.coordinate_decimals) if key == "form" else value
+            try:
+                self.recorder.write(entry)
+            except Exception as e:
+                logger.warning(f"Traffic recording failed: {str(e)}")
@@ -0,0 +1,63 @@
+"""
+Stand-in for the Windy point-forecast API, for local runs and load tests.
+
+Returns deterministic 3-hourly `past3hprecip-surface` series per (lat, lon, model),
+so results are reproducible without an API key or network access:
+
+    uvicorn windy_stub:app --port 8001
+    WINDY_API_URL=http://localhost:8001/api/point-forecast/v2 uvicorn floodPredictionAPI:app
+
+WINDY_STUB_LATENCY_MS adds a fixed delay per call to mimic the real upstream.
+WINDY_STUB_MODELS limits which models are accepted (others get 400, as Windy does).
+
+tests/ drives the ensemble path against this stub: python -m pytest src/lib/tests
+"""
+import hashlib
+import math
+import os
+import time
+
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+from typing import List
+
+app = FastAPI(title="Windy Point Forecast Stub")
+
+LATENCY_MS = float(os.getenv("WINDY_STUB_LATENCY_MS", "0"))
+MODELS = [m.strip() for m in os.getenv("WINDY_STUB_MODELS", "gfs,ecmwf,icon").split(",") if m.strip()]
+STEP_MS = 3 * 3600 * 1000
+STEPS = 80  # 10 days of 3-hourly values, like a GFS run
+
+
+class PointForecastRequest(BaseModel):
+    lat: float
+    lon: float
+    model: str = "gfs"
+    parameters: List[str] = ["precip"]
+    levels: List[str] = ["surface"]
+    key: str = ""
+
+
+def synthetic_precip(lat: float, lon: float, model: str, steps: int = STEPS):
+    """A rain event whose timing and strength depend on location; each model is a slightly perturbed member."""
+    seed = int(hashlib.sha256(f"{lat:.2f},{lon:.2f}".encode()).hexdigest()[:8], 16)
+    member = int(hashlib.sha256(model.encode()).hexdigest()[:4], 16) / 0xFFFF
+    peak = 16 + seed % 40 + member * 4
+    strength = 2 + (seed >> 8) % 10 + member * 2
+    return [
+        round(max(0.0, strength * math.exp(-((i - peak) / 8) ** 2) + 0.3 * math.sin(i / 3 + member)), 3)
+        for i in range(steps)
+    ]
+
+
+@app.post("/api/point-forecast/v2")
+def point_forecast(req: PointForecastRequest):
+    if req.model not in MODELS:
+        raise HTTPException(status_code=400, detail=f"Unsupported model '{req.model}'")
+    if LATENCY_MS:
+        time.sleep(LATENCY_MS / 1000)
+    start = int(time.time() * 1000) // STEP_MS * STEP_MS
+    return {
+        "ts": [start + i * STEP_MS for i in range(STEPS)],
+        "past3hprecip-surface": synthetic_precip(req.lat, req.lon, req.model),
+    }
@@ -0,0 +1,266 @@
+"""
+Load-Aware Admission Control
+Cost-weighted token buckets per client, priority classes (NDMA and NGO ahead of the public),
+and queue-time based load shedding with Retry-After hints
+
+Kept identical in xview2-model/ and src/lib/ because each service is built from its own
+directory; src/lib/tests/test_shared_modules.py fails if the copies drift
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Any, Optional, Tuple
+
+# Priority classes, lower value is served first
+CRITICAL, PARTNER, PUBLIC = 0, 1, 2
+CLASS_NAMES = {CRITICAL: "critical", PARTNER: "partner", PUBLIC: "public"}
+
+# Roles used by the JalRakshak frontend mapped to priority classes
+ROLE_CLASSES = {
+    "ndma": CRITICAL,
+    "dma": CRITICAL,
+    "admin": CRITICAL,
+    "ngo": PARTNER,
+    "volunteer": PARTNER,
+    "public": PUBLIC
+}
+
+# Per-class defaults: token refill (cost units/second), bucket size, longest acceptable queue wait (s)
+CLASS_LIMITS = {
+    CRITICAL: {"rate": 10.0, "burst": 600.0, "max_wait": 30.0},
+    PARTNER: {"rate": 1.0, "burst": 120.0, "max_wait": 10.0},
+    PUBLIC: {"rate": 0.1, "burst": 10.0, "max_wait": 2.0}
+}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is rate limited (429) or shed under load (503)"""
+
+    def __init__(self, status_code: int, retry_after: float, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        self.detail = detail
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost: float) -> float:
+        """Consume cost tokens; returns 0 on success or seconds until enough tokens exist"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if cost > self.burst:
+            # Oversized requests are allowed from a full bucket rather than never
+            cost = self.burst
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class _Ticket:
+    """One request's place in the admission queue"""
+    __slots__ = ("priority", "seq", "cost", "granted", "notify")
+
+    def __init__(self, priority: int, seq: int, cost: float):
+        self.priority = priority
+        self.seq = seq
+        self.cost = cost
+        self.granted = False
+        self.notify = None  # called (under the controller lock) when the slot is granted
+
+    def __lt__(self, other: "_Ticket") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    """
+    Admits work in two steps:
+      charge(): per-client token bucket weighted by request cost -> 429 when exhausted
+      slot():   bounded concurrency with a priority queue; requests whose expected queue
+                wait exceeds their class limit are shed -> 503
+    async_slot() is the same queue for async endpoints: the wait happens on the event loop,
+    so queued requests do not hold threadpool threads and cannot starve critical callers
+    """
+
+    def __init__(self, capacity: int = 1, api_keys: Optional[Dict[str, str]] = None,
+                 max_buckets: int = 100000):
+        self.capacity = max(1, capacity)
+        self.api_keys = api_keys or {}  # api key -> role
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        # Least recently charged first, so the longest-idle clients are evicted when full
+        self._buckets: "OrderedDict[Tuple[str, int], _TokenBucket]" = OrderedDict()
+        self._queue = []  # heap of waiting _Tickets
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._in_flight_cost = 0.0
+        self._queued_cost = {priority: 0.0 for priority in CLASS_NAMES}
+        # Exponentially weighted seconds of service per unit of cost, used to predict queue wait
+        self._seconds_per_unit = 1.0
+        self._stats = {
+            name: {"admitted": 0, "rate_limited": 0, "shed": 0} for name in CLASS_NAMES.values()
+        }
+
+    @classmethod
+    def from_env(cls, capacity: int = 1) -> "AdmissionController":
+        """Build from ADMISSION_API_KEYS="ndma:<key>,ngo:<key>" """
+        api_keys = {}
+        for entry in os.environ.get("ADMISSION_API_KEYS", "").split(","):
+            if ":" in entry:
+                role, key = entry.split(":", 1)
+                api_keys[key.strip()] = role.strip().lower()
+        return cls(capacity=capacity, api_keys=api_keys)
+
+    def classify(self, api_key: Optional[str]) -> int:
+        role = self.api_keys.get(api_key or "", "public")
+        return ROLE_CLASSES.get(role, PUBLIC)
+
+    def set_capacity(self, capacity: int):
+        with self._lock:
+            self.capacity = max(1, capacity)
+            self._dispatch()
+
+    def charge(self, client: str, priority: int, cost: float):
+        """Take cost tokens from the client's bucket or raise a 429 rejection"""
+        limits = CLASS_LIMITS[priority]
+        with self._lock:
+            key = (client, priority)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_buckets:
+                    self._buckets.popitem(last=False)
+                bucket = self._buckets[key] = _TokenBucket(limits["rate"], limits["burst"])
+            else:
+                self._buckets.move_to_end(key)
+            wait = bucket.take(cost)
+            if wait > 0:
+                self._stats[CLASS_NAMES[priority]]["rate_limited"] += 1
+                raise AdmissionRejected(429, wait, "Rate limit exceeded for this client")
+
+    def _expected_wait(self, priority: int) -> float:
+        # Work that will be served before this request: everything running plus queued work of equal or higher priority
+        ahead = self._in_flight_cost + sum(
+            cost for queued_priority, cost in self._queued_cost.items() if queued_priority <= priority
+        )
+        if self._in_flight < self.capacity and not self._queue:
+            return 0.0
+        return ahead * self._seconds_per_unit / self.capacity
+
+    def _enter(self, priority: int, cost: float, notify) -> _Ticket:
+        """Shed, grant immediately, or queue; caller holds the lock"""
+        expected = self._expected_wait(priority)
+        if expected > CLASS_LIMITS[priority]["max_wait"]:
+            self._stats[CLASS_NAMES[priority]]["shed"] += 1
+            raise AdmissionRejected(503, expected, "Server is overloaded, retry later")
+        ticket = _Ticket(priority, next(self._seq), cost)
+        ticket.notify = notify
+        if self._in_flight < self.capacity and not self._queue:
+            self._grant(ticket)
+        else:
+            heapq.heappush(self._queue, ticket)
+            self._queued_cost[priority] += cost
+        return ticket
+
+    def _grant(self, ticket: _Ticket):
+        ticket.granted = True
+        self._in_flight += 1
+        self._in_flight_cost += ticket.cost
+        self._stats[CLASS_NAMES[ticket.priority]]["admitted"] += 1
+
+    def _dispatch(self):
+        # Hand free slots to the highest-priority waiters; caller holds the lock
+        while self._queue and self._in_flight < self.capacity:
+            ticket = heapq.heappop(self._queue)
+            self._queued_cost[ticket.priority] -= ticket.cost
+            self._grant(ticket)
+            ticket.notify()
+
+    def _abandon(self, ticket: _Ticket, shed: bool = True) -> AdmissionRejected:
+        """Take a waiter that timed out (or went away) off the queue; caller holds the lock"""
+        self._queue.remove(ticket)
+        heapq.heapify(self._queue)
+        self._queued_cost[ticket.priority] -= ticket.cost
+        if shed:
+            self._stats[CLASS_NAMES[ticket.priority]]["shed"] += 1
+        return AdmissionRejected(503, self._expected_wait(ticket.priority), "Server is overloaded, retry later")
+
+    def _release(self, ticket: _Ticket, elapsed: Optional[float]):
+        with self._lock:
+            self._in_flight -= 1
+            self._in_flight_cost -= ticket.cost
+            if elapsed is not None:
+                self._seconds_per_unit = 0.8 * self._seconds_per_unit + 0.2 * (elapsed / max(ticket.cost, 1e-6))
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority: int, cost: float):
+        """Hold one of `capacity` execution slots; sheds if the queue wait would be too long"""
+        granted = threading.Event()
+        with self._lock:
+            ticket = self._enter(priority, cost, granted.set)
+        if not ticket.granted and not granted.wait(CLASS_LIMITS[priority]["max_wait"]):
+            with self._lock:
+                if not ticket.granted:
+                    raise self._abandon(ticket)
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(ticket, time.monotonic() - started)
+
+    @asynccontextmanager
+    async def async_slot(self, priority: int, cost: float):
+        """slot() for coroutines: waits on the event loop instead of blocking a thread"""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        with self._lock:
+            ticket = self._enter(priority, cost, notify)
+        if not ticket.granted:
+            try:
+                await asyncio.wait_for(asyncio.shield(granted), CLASS_LIMITS[priority]["max_wait"])
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                with self._lock:
+                    if not ticket.granted:
+                        if isinstance(e, asyncio.CancelledError):
+                            self._abandon(ticket, shed=False)
+                            raise
+                        raise self._abandon(ticket)
+                if isinstance(e, asyncio.CancelledError):
+                    # Granted as the caller went away: hand the slot straight back
+                    self._release(ticket, None)
+                    raise
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(ticket, time.monotonic() - started)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "in_flight": self._in_flight,
+                "queued": len(self._queue),
+                "seconds_per_cost_unit": round(self._seconds_per_unit, 4),
+                "by_class": {name: dict(stats) for name, stats in self._stats.items()}
+            }
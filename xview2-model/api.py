@@ -6,14 +6,26 @@ Deployed on Google Cloud Run for JalRakshak Flood Early Warning System
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 import uvicorn
+import threading
 import tempfile
 import os
+import copy
+import io
 import json
 import logging
 from typing import Optional
 from inference import xView2Inference
 from indian_damage_mapping import IndianDamageMapper
+from relief_aggregator import ReliefAggregator
+from near_duplicate import NearDuplicateIndex, hamming_distance
+import autotune
+from admission import AdmissionController, AdmissionRejected, PUBLIC
+from memory import MemoryWatchdog
+from traffic_recorder import TrafficRecorder, TrafficRecorderMiddleware, annotate
+from PIL import Image
+import math
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
@@ -45,19 +57,229 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Optional anonymised traffic log for load replay (scripts/replay_traffic.py)
+traffic_recorder = TrafficRecorder.from_env()
+if traffic_recorder is not None:
+    app.add_middleware(TrafficRecorderMiddleware, recorder=traffic_recorder)
+
 # Initialize model (lazy loading)
 model_instance = None
+model_lock = threading.Lock()
+# Cost-aware admission for inference: bounds concurrent forward passes (sized by the
+# autotuner at startup), prioritises NDMA/NGO keys and sheds load with Retry-After
+admission = AdmissionController.from_env(capacity=int(os.environ.get("INFERENCE_WORKERS", "1")))
+# Keeps the worker under its Cloud Run memory cap: trims above the soft limit,
+# refuses new inference with 503 above the hard limit until RSS falls back
+memory_watchdog = MemoryWatchdog(
+    soft_limit_mb=float(os.environ.get("MEMORY_SOFT_LIMIT_MB", "1536")),
+    hard_limit_mb=float(os.environ.get("MEMORY_HARD_LIMIT_MB", "1843"))
+)
 damage_mapper = IndianDamageMapper()
+relief_aggregator = ReliefAggregator()
+duplicate_index = None
+if os.environ.get("NEAR_DUPLICATE_ENABLED", "false").lower() == "true":
+    duplicate_index = NearDuplicateIndex(
+        max_distance=int(os.environ.get("NEAR_DUPLICATE_DISTANCE", "6")),
+        radius_m=float(os.environ.get("NEAR_DUPLICATE_RADIUS_M", "50"))
+    )
 
 def get_model():
     """Get or initialize model instance"""
     global model_instance
-    if model_instance is None:
-        logger.info("Initializing xView2 model...")
-        model_instance = xView2Inference(device="cpu")  # Use CPU for Cloud Run
-        logger.info("Model initialized successfully")
+    with model_lock:
+        if model_instance is None:
+            logger.info("Initializing xView2 model...")
+            model_instance = xView2Inference(
+                device="cpu",  # Use CPU for Cloud Run
+                cascade=os.environ.get("CASCADE_ENABLED", "false").lower() == "true",
+                cascade_threshold=float(os.environ.get("CASCADE_THRESHOLD", "0.85")),
+                screening_model_path=os.environ.get("SCREENING_MODEL_PATH"),
+                escalation_mode=os.environ.get("CASCADE_ESCALATION", "resize")
+            )
+            model_instance.configure_buffers(batch_size=1, workers=admission.capacity)
+            logger.info("Model initialized successfully")
     return model_instance
 
+def record_uploads(request: Request, field: str, contents: list, **form):
+    """Log upload dimensions and content tokens (never pixels) for traffic replay"""
+    if traffic_recorder is None:
+        return
+    shapes = []
+    for content in contents:
+        try:
+            with Image.open(io.BytesIO(content)) as image:
+                width, height = image.size
+        except Exception:
+            width, height = 0, 0
+        shapes.append([width, height, traffic_recorder.content_token(content)])
+    annotate(request, files={field: shapes}, form=form)
+
+def image_cost(image_path: str) -> int:
+    """Admission cost of an image: its size in megapixels, at least 1"""
+    try:
+        with Image.open(image_path) as image:
+            width, height = image.size
+        return max(1, math.ceil(width * height / 1_000_000))
+    except Exception:
+        return 1
+
+async def run_inference(request: Request, cost: float, func, *args, **kwargs):
+    """
+    Admit the request by cost and priority, then run blocking inference off the event loop
+    The queue wait happens on the event loop; only admitted work takes a threadpool thread
+    """
+    api_key = request.headers.get("X-API-Key")
+    priority = admission.classify(api_key)
+    client = api_key if priority != PUBLIC else get_remote_address(request)
+    
+    if memory_watchdog.over_limit:
+        memory_watchdog.refusals += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Server is low on memory, retry later",
+            headers={"Retry-After": str(int(memory_watchdog.interval_s))}
+        )
+    try:
+        admission.charge(client, priority, cost)
+        async with admission.async_slot(priority, cost):
+            return await run_in_threadpool(func, *args, **kwargs)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+@app.on_event("startup")
+async def tune_inference_runtime():
+    """Pick intra-op threads, concurrent workers and batch size for this instance"""
+    memory_watchdog.start()
+    autotune.set_interop_threads(1)
+    if os.environ.get("AUTOTUNE_ENABLED", "false").lower() != "true":
+        return
+    
+    objective = os.environ.get("AUTOTUNE_OBJECTIVE", "throughput")
+    config_path = os.environ.get("AUTOTUNE_RESULT_PATH", "autotune.json")
+    model = get_model()
+    # Trials and the chosen configuration must leave room under the watchdog's soft limit
+    memory_limit_mb = memory_watchdog.soft_limit / 2**20
+    config = autotune.load_config(config_path, objective, memory_limit_mb)
+    if config is None:
+        logger.info(f"Autotuning inference runtime for {objective}...")
+        config = await run_in_threadpool(
+            autotune.autotune, model.model, model.device, objective,
+            seconds_per_trial=float(os.environ.get("AUTOTUNE_SECONDS_PER_TRIAL", "1.0")),
+            memory_limit_mb=memory_limit_mb
+        )
+        try:
+            autotune.save_config(config_path, config)
+        except OSError as e:
+            logger.warning(f"Could not record autotune result: {str(e)}")
+    
+    autotune.apply_config(config)
+    best = config["best"]
+    model.configure_buffers(batch_size=best["batch_size"], workers=best["workers"])
+    model.runtime_config = {
+        "objective": config["objective"],
+        "tuned_at": config["tuned_at"],
+        "workers": best["workers"],
+        "images_per_second": best["images_per_second"],
+        "p95_latency_ms": best["p95_latency_ms"]
+    }
+    admission.set_capacity(best["workers"])
+    logger.info(f"Inference runtime: {best['intra_op_threads']} threads x {best['workers']} workers, batch {best['batch_size']}")
+
+def _duplicate_result(assessment: dict, assessment_id: str, hash_distance: int,
+                      distance_m: Optional[float] = None) -> dict:
+    result = copy.deepcopy(assessment)
+    result["near_duplicate"] = {
+        "duplicate_of": assessment_id,
+        "hash_distance": hash_distance,
+        "distance_m": None if distance_m is None else round(distance_m, 1),
+        "reused": True
+    }
+    return result
+
+def assess_images(image_paths: list, state: str, latitude: Optional[float] = None,
+                  longitude: Optional[float] = None, district: Optional[str] = None) -> list:
+    """
+    Run damage assessment, reusing the stored result for near-duplicate images
+    Only fresh assessments are added to the relief totals, so the same structure is counted once.
+    Without coordinates, look-alike images in one batch are only grouped in the response: each is
+    still assessed and counted, since a hash match alone is no proof of the same structure
+    """
+    located = latitude is not None and longitude is not None
+    results = [None] * len(image_paths)
+    hashes = [None] * len(image_paths)
+    pending = []  # positions that need the model
+    pending_duplicates = {}  # position -> (pending position it duplicates, hash distance)
+    grouped = {}  # position -> (pending position it resembles, hash distance), both assessed
+    
+    for position, image_path in enumerate(image_paths):
+        if duplicate_index is not None:
+            try:
+                hashes[position] = duplicate_index.hash_image(image_path)
+            except Exception as e:
+                logger.warning(f"Perceptual hash failed, skipping duplicate check: {str(e)}")
+        
+        hash_value = hashes[position]
+        if hash_value is not None:
+            match = duplicate_index.lookup(hash_value, state, latitude, longitude)
+            if match is not None:
+                results[position] = _duplicate_result(
+                    match["assessment"], match["assessment_id"], match["hash_distance"], match["distance_m"]
+                )
+                continue
+            # Duplicates within the same request are not in the index yet
+            nearest = min(
+                ((hamming_distance(hash_value, hashes[other]), other) for other in pending
+                 if hashes[other] is not None),
+                default=None
+            )
+            if nearest is not None and nearest[0] <= duplicate_index.max_distance:
+                if located:
+                    pending_duplicates[position] = (nearest[1], nearest[0])
+                    continue
+                grouped[position] = (nearest[1], nearest[0])
+        pending.append(position)
+    
+    if pending:
+        model = get_model()
+        predictions = model.batch_predict([image_paths[position] for position in pending], state)
+        for position, result in zip(pending, predictions):
+            relief_aggregator.record(result, district=district)
+            if hashes[position] is not None and "error" not in result:
+                result["assessment_id"] = duplicate_index.add(
+                    hashes[position], copy.deepcopy(result), state, latitude, longitude
+                )
+            results[position] = result
+    
+    for position, (original, hash_distance) in grouped.items():
+        if "assessment_id" in results[original] and "error" not in results[position]:
+            results[position]["near_duplicate"] = {
+                "duplicate_of": results[original]["assessment_id"],
+                "hash_distance": hash_distance,
+                "distance_m": None,
+                "reused": False
+            }
+    
+    for position, (original, hash_distance) in pending_duplicates.items():
+        original_result = results[original]
+        if "assessment_id" in original_result:
+            results[position] = _duplicate_result(
+                {key: value for key, value in original_result.items() if key != "assessment_id"},
+                original_result["assessment_id"], hash_distance
+            )
+        else:
+            results[position] = copy.deepcopy(original_result)
+    
+    return results
+
+def assess_image(image_path: str, state: str, latitude: Optional[float] = None,
+                 longitude: Optional[float] = None, district: Optional[str] = None) -> dict:
+    """Run damage assessment for a single image"""
+    return assess_images([image_path], state, latitude, longitude, district)[0]
+
 @app.get("/")
 @limiter.limit("10/hour")
 async def root(request: Request):
@@ -78,7 +300,8 @@ async def health_check(request: Request):
         return {
             "status": "healthy",
             "model_loaded": True,
-            "model_info": model_info
+            "model_info": model_info,
+            "memory": memory_watchdog.get_stats()
         }
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
@@ -88,15 +311,16 @@ async def health_check(request: Request):
             "error": str(e)
         }
 
+# Inference endpoints are admitted by AdmissionController instead of the flat per-IP limit
 @app.post("/analyze")
-@limiter.limit("10/hour")
 async def analyze_damage(
     request: Request,
     file: UploadFile = File(...),
     state: str = Form(default="punjab"),
     latitude: Optional[float] = Form(default=None),
     longitude: Optional[float] = Form(default=None),
-    user_id: Optional[str] = Form(default=None)
+    user_id: Optional[str] = Form(default=None),
+    district: Optional[str] = Form(default=None)
 ):
     """
     Analyze flood damage from uploaded image
@@ -107,6 +331,7 @@ async def analyze_damage(
         latitude: GPS latitude (optional)
         longitude: GPS longitude (optional)
         user_id: User identifier (optional)
+        district: District name for relief aggregation (optional)
     
     Returns:
         JSON with damage assessment and recommendations
@@ -130,11 +355,14 @@ async def analyze_damage(
             content = await file.read()
             tmp_file.write(content)
             tmp_file_path = tmp_file.name
+        record_uploads(request, "file", [content], state=state, district=district,
+                       latitude=latitude, longitude=longitude)
         
         try:
-            # Get model and run inference
-            model = get_model()
-            result = model.predict_damage(tmp_file_path, state.lower())
+            # Run inference (or reuse a near-duplicate's assessment)
+            result = await run_inference(
+                request, image_cost(tmp_file_path), assess_image, tmp_file_path, state.lower(), latitude, longitude, district
+            )
             
             # Add metadata
             result.update({
@@ -148,6 +376,7 @@ async def analyze_damage(
                         "longitude": longitude
                     },
                     "user_id": user_id,
+                    "district": district,
                     "timestamp": "2024-01-01T00:00:00Z"  # Add actual timestamp
                 }
             })
@@ -162,6 +391,8 @@ async def analyze_damage(
             if os.path.exists(tmp_file_path):
                 os.unlink(tmp_file_path)
                 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Analysis failed: {str(e)}")
         raise HTTPException(
@@ -205,12 +436,48 @@ async def get_model_info(request: Request):
             detail=f"Failed to get model info: {str(e)}"
         )
 
-@app.post("/batch-analyze")
+@app.get("/duplicates/stats")
+@limiter.limit("10/hour")
+async def get_duplicate_stats(request: Request):
+    """Get near-duplicate index statistics"""
+    if duplicate_index is None:
+        return {"enabled": False}
+    return {"enabled": True, **duplicate_index.get_stats()}
+
+@app.get("/admission/stats")
+@limiter.limit("10/hour")
+async def get_admission_stats(request: Request):
+    """Get admission control statistics per priority class"""
+    return admission.get_stats()
+
+@app.get("/relief/snapshot")
+@limiter.limit("10/hour")
+async def get_relief_snapshot(request: Request):
+    """Get running relief cost totals by state, district and NDMA category"""
+    return relief_aggregator.snapshot()
+
+@app.get("/model/routing-stats")
 @limiter.limit("10/hour")
+async def get_routing_stats(request: Request):
+    """Get cascade routing statistics per inference stage"""
+    try:
+        model = get_model()
+        return {
+            "cascade_enabled": model.cascade,
+            **model.get_routing_stats()
+        }
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to get routing stats: {str(e)}"
+        )
+
+@app.post("/batch-analyze")
 async def batch_analyze_damage(
     request: Request,
     files: list[UploadFile] = File(...),
-    state: str = Form(default="punjab")
+    state: str = Form(default="punjab"),
+    district: Optional[str] = Form(default=None)
 ):
     """
     Analyze multiple images for flood damage
@@ -218,6 +485,7 @@ async def batch_analyze_damage(
     Args:
         files: List of image files
         state: Indian state
+        district: District name for relief aggregation (optional)
     
     Returns:
         List of damage assessments
@@ -229,30 +497,47 @@ async def batch_analyze_damage(
                 detail="Maximum 10 images allowed per batch"
             )
         
-        results = []
         temp_files = []
+        filenames = []
+        contents = []
         
         try:
-            # Process each file
+            # Save each image temporarily
             for file in files:
                 if not file.content_type.startswith('image/'):
                     continue
                 
-                # Save file temporarily
                 with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
                     content = await file.read()
                     tmp_file.write(content)
                     temp_files.append(tmp_file.name)
-                
-                # Analyze damage
-                model = get_model()
-                result = model.predict_damage(tmp_file.name, state.lower())
-                result["filename"] = file.filename
-                results.append(result)
+                    filenames.append(file.filename)
+                    contents.append(content)
+            record_uploads(request, "files", contents, state=state, district=district)
+            
+            # Analyze damage in batched forward passes
+            batch_cost = sum(image_cost(temp_file) for temp_file in temp_files)
+            results = await run_inference(
+                request, batch_cost, assess_images, temp_files, state.lower(), district=district
+            )
+            for result, filename in zip(results, filenames):
+                result["filename"] = filename
+            
+            # Group near-duplicates so callers can count each structure once
+            duplicate_groups = {}
+            for result in results:
+                group_id = result.get("near_duplicate", {}).get("duplicate_of") or result.get("assessment_id")
+                if group_id:
+                    duplicate_groups.setdefault(group_id, []).append(result["filename"])
             
             return {
                 "results": results,
                 "total_processed": len(results),
+                "unique_structures": len(duplicate_groups) + sum(
+                    1 for result in results
+                    if "assessment_id" not in result and "near_duplicate" not in result
+                ),
+                "duplicate_groups": [files for files in duplicate_groups.values() if len(files) > 1],
                 "state": state
             }
             
@@ -262,6 +547,8 @@ async def batch_analyze_damage(
                 if os.path.exists(temp_file):
                     os.unlink(temp_file)
                     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Batch analysis failed: {str(e)}")
         raise HTTPException(
@@ -277,7 +564,8 @@ async def http_exception_handler(request, exc):
         content={
             "error": exc.detail,
             "status_code": exc.status_code
-        }
+        },
+        headers=getattr(exc, "headers", None)
     )
 
 @app.exception_handler(Exception)
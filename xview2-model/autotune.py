@@ -0,0 +1,192 @@
+"""
+CPU Inference Autotuner
+Benchmarks (intra-op threads, concurrent workers, batch size) combinations on the running
+instance with a synthetic batch and picks the best one for throughput or latency, among those
+whose concurrent forward passes fit in the memory limit
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+import torch
+import torch.nn as nn
+from memory import current_rss_bytes
+
+
+def default_candidates(cpu_count: int) -> List[Tuple[int, int, int]]:
+    """(threads, workers, batch_size) combinations that do not oversubscribe the CPU"""
+    thread_options = sorted({1, 2, 4, cpu_count} & set(range(1, cpu_count + 1)))
+    candidates = []
+    for threads in thread_options:
+        for workers in (1, 2, 4):
+            if threads * workers > cpu_count:
+                continue
+            for batch_size in (1, 4, 8):
+                candidates.append((threads, workers, batch_size))
+    return candidates
+
+
+def activation_bytes(model: nn.Module, device: torch.device, input_size: int = 512) -> int:
+    """
+    Estimated peak memory of one image's forward pass: the largest input + output of any leaf
+    module, which is what a sequential network holds at once under no_grad
+    """
+    peak = 0
+
+    def measure(module, inputs, output):
+        nonlocal peak
+        tensors = [t for t in (*inputs, output) if torch.is_tensor(t)]
+        peak = max(peak, sum(t.numel() * t.element_size() for t in tensors))
+
+    handles = [module.register_forward_hook(measure) for module in model.modules()
+               if not list(module.children())]
+    try:
+        with torch.no_grad():
+            model(torch.zeros(1, 3, input_size, input_size, device=device))
+    finally:
+        for handle in handles:
+            handle.remove()
+    return peak
+
+
+def fit_memory(candidates: List[Tuple[int, int, int]], bytes_per_image: int,
+               budget_bytes: float) -> Tuple[List[Tuple[int, int, int]], List[Tuple[int, int, int]]]:
+    """
+    Split candidates into those whose workers x batch_size images in flight fit the budget and
+    those that do not; the smallest footprint is kept even when nothing fits
+    """
+    fits = [c for c in candidates if c[1] * c[2] * bytes_per_image <= budget_bytes]
+    if not fits:
+        fits = [min(candidates, key=lambda c: (c[1] * c[2], -c[0]))]
+    return fits, [c for c in candidates if c not in fits]
+
+
+def _benchmark(model: nn.Module, device: torch.device, threads: int, workers: int,
+               batch_size: int, input_size: int, seconds: float) -> Dict[str, Any]:
+    """Run `workers` threads doing forward passes for `seconds` and collect call latencies"""
+    torch.set_num_threads(threads)
+    batch = torch.randn(batch_size, 3, input_size, input_size, device=device)
+    with torch.no_grad():
+        model(batch)  # warm-up
+
+    latencies: List[float] = []
+    latencies_lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        local = []
+        with torch.no_grad():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                model(batch)
+                local.append(time.perf_counter() - start)
+        with latencies_lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    calls = len(latencies)
+    return {
+        "intra_op_threads": threads,
+        "workers": workers,
+        "batch_size": batch_size,
+        "images_per_second": round(calls * batch_size / elapsed, 2),
+        "p50_latency_ms": round(latencies[calls // 2] * 1000, 2) if calls else None,
+        "p95_latency_ms": round(latencies[min(calls - 1, int(calls * 0.95))] * 1000, 2) if calls else None
+    }
+
+
+def autotune(model: nn.Module, device: torch.device, objective: str = "throughput",
+             input_size: int = 512, seconds_per_trial: float = 1.0,
+             candidates: Optional[List[Tuple[int, int, int]]] = None,
+             memory_limit_mb: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Benchmark candidate configurations and return the best one with all trial results
+    objective: "throughput" maximises images/s, "latency" minimises p95 call latency
+    memory_limit_mb: configurations whose concurrent forward passes would push RSS past it
+    are not tried (a trial that runs them could itself take the instance down)
+    """
+    if objective not in ("throughput", "latency"):
+        raise ValueError(f"Unknown autotune objective: {objective}")
+
+    cpu_count = os.cpu_count() or 1
+    candidates = candidates or default_candidates(cpu_count)
+    original_threads = torch.get_num_threads()
+
+    bytes_per_image = activation_bytes(model, device, input_size) + 3 * input_size * input_size * 4
+    over_memory = []
+    if memory_limit_mb is not None:
+        budget = memory_limit_mb * 2**20 - current_rss_bytes()
+        candidates, over_memory = fit_memory(candidates, bytes_per_image, budget)
+
+    trials = []
+    try:
+        for threads, workers, batch_size in candidates:
+            trials.append(_benchmark(model, device, threads, workers, batch_size,
+                                     input_size, seconds_per_trial))
+    finally:
+        torch.set_num_threads(original_threads)
+
+    measured = [trial for trial in trials if trial["p95_latency_ms"] is not None]
+    if objective == "throughput":
+        best = max(measured, key=lambda trial: trial["images_per_second"])
+    else:
+        best = min(measured, key=lambda trial: trial["p95_latency_ms"])
+
+    return {
+        "objective": objective,
+        "cpu_count": cpu_count,
+        "input_size": input_size,
+        "memory_limit_mb": memory_limit_mb,
+        "activation_mb_per_image": round(bytes_per_image / 2**20, 1),
+        "over_memory": [list(c) for c in over_memory],
+        "tuned_at": time.time(),
+        "best": best,
+        "trials": trials
+    }
+
+
+def apply_config(config: Dict[str, Any]):
+    """Set torch threading from a tuning result"""
+    torch.set_num_threads(config["best"]["intra_op_threads"])
+
+
+def set_interop_threads(threads: int = 1):
+    """
+    Inter-op parallelism is unused by eager forward passes here; pin it low so it does not
+    add threads on top of concurrent workers. Only allowed before any parallel work has run.
+    """
+    try:
+        torch.set_num_interop_threads(threads)
+    except RuntimeError:
+        pass
+
+
+def load_config(path: str, objective: str, memory_limit_mb: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """Load a recorded tuning result if it was measured for this objective, CPU count and memory limit"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if config.get("cpu_count") != (os.cpu_count() or 1) or config.get("objective") != objective:
+        return None
+    if config.get("memory_limit_mb") != memory_limit_mb:
+        return None
+    return config
+
+
+def save_config(path: str, config: Dict[str, Any]):
+    with open(path, "w") as f:
+        json.dump(config, f, indent=2)
@@ -5,17 +5,21 @@ Modified for Indian Flood Early Warning System (JalRakshak)
 
 import torch
 import torch.nn as nn
-import torchvision.transforms as transforms
 from PIL import Image
 import numpy as np
 import cv2
 import json
 import os
+import threading
+import time
 from typing import Dict, Any, Tuple
 from indian_damage_mapping import IndianDamageMapper
+from memory import TensorBufferPool, open_image
 
 class xView2Inference:
-    def __init__(self, model_path: str = None, device: str = "cpu"):
+    def __init__(self, model_path: str = None, device: str = "cpu",
+                 cascade: bool = False, cascade_threshold: float = 0.85,
+                 screening_model_path: str = None, escalation_mode: str = "resize"):
         self.device = torch.device(device if torch.cuda.is_available() else "cpu")
         self.damage_mapper = IndianDamageMapper()
         
@@ -24,13 +28,32 @@ class xView2Inference:
         self.model = self._load_model(model_path)
         self.model.eval()
         
-        # Image preprocessing
-        self.transform = transforms.Compose([
-            transforms.Resize((512, 512)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], 
-                               std=[0.229, 0.224, 0.225])
-        ])
+        # Cascade mode: a small screening model at low resolution clears confident
+        # "no-damage" images; everything else is escalated to the full model
+        if escalation_mode not in ("resize", "tiled"):
+            raise ValueError(f"Unknown escalation mode: {escalation_mode}")
+        self.cascade = cascade
+        self.cascade_threshold = cascade_threshold
+        self.escalation_mode = escalation_mode
+        self.tile_size = 512
+        self.screening_model = None
+        if cascade:
+            self.screening_model = self._load_screening_model(screening_model_path)
+            self.screening_model.eval()
+        # Set by the autotuner at startup; batch_predict runs forward passes of this size
+        self.batch_size = 1
+        self.runtime_config = None
+        self.configure_buffers(batch_size=1, workers=1)
+        
+        self._stats_lock = threading.Lock()
+        self.routing_stats = {
+            "total": 0,
+            "resolved_at_screening": 0,
+            "escalated_uncertain": 0,
+            "escalated_damage": 0,
+            "screening_time_s": 0.0,
+            "full_model_time_s": 0.0
+        }
         
         # Damage class mapping
         self.damage_classes = {
@@ -82,56 +105,153 @@ class xView2Inference:
             
         return model.to(self.device)
 
-    def preprocess_image(self, image_path: str) -> torch.Tensor:
-        """Preprocess image for model inference"""
-        try:
-            # Load image
-            image = Image.open(image_path).convert('RGB')
-            
-            # Apply transforms
-            image_tensor = self.transform(image).unsqueeze(0)
+    def _load_screening_model(self, model_path: str = None):
+        """Load the first-stage screening classifier (128x128 input)"""
+        class TinyDamageClassifier(nn.Module):
+            def __init__(self, num_classes=4):
+                super().__init__()
+                self.backbone = nn.Sequential(
+                    nn.Conv2d(3, 16, 3, stride=2, padding=1),
+                    nn.ReLU(),
+                    nn.Conv2d(16, 32, 3, stride=2, padding=1),
+                    nn.ReLU(),
+                    nn.AdaptiveAvgPool2d((1, 1))
+                )
+                self.classifier = nn.Sequential(
+                    nn.Flatten(),
+                    nn.Linear(32, num_classes)
+                )
+                
+            def forward(self, x):
+                x = self.backbone(x)
+                return self.classifier(x)
+        
+        model = TinyDamageClassifier()
+        
+        if model_path and os.path.exists(model_path):
+            model.load_state_dict(torch.load(model_path, map_location=self.device))
+        else:
+            print("Warning: Using random weights for screening model. Load trained weights for production.")
             
-            return image_tensor.to(self.device)
+        return model.to(self.device)
+
+    def configure_buffers(self, batch_size: int, workers: int):
+        """(Re)allocate pooled input buffers: one batch per concurrent worker"""
+        self.batch_size = batch_size
+        self.input_pool = TensorBufferPool(512, batch_size, workers, self.device)
+        self.screening_pool = None
+        if self.cascade:
+            self.screening_pool = TensorBufferPool(128, 1, workers, self.device)
+
+    def _open(self, image_path: str) -> Image.Image:
+        # Tiled escalation needs native resolution; otherwise decode no larger than the model input
+        try:
+            if self.cascade and self.escalation_mode == "tiled":
+                return Image.open(image_path).convert('RGB')
+            return open_image(image_path, 512)
         except Exception as e:
             raise ValueError(f"Error preprocessing image: {str(e)}")
 
+    def _classify_image(self, model: nn.Module, pool: TensorBufferPool, image: Image.Image) -> Tuple[int, float]:
+        """Write the image into a pooled input buffer and classify it"""
+        with pool.batch() as buffer:
+            pool.fill(buffer[0], image)
+            return self._classify(model, pool.to_device(buffer, 1))
+
+    def _classify(self, model: nn.Module, image_tensor: torch.Tensor) -> Tuple[int, float]:
+        """Run one model and return (predicted class, confidence)"""
+        with torch.inference_mode():
+            outputs = model(image_tensor)
+            probabilities = torch.softmax(outputs, dim=1)
+            confidence, predicted_class = torch.max(probabilities, 1)
+        return predicted_class.item(), confidence.item()
+
+    def _tile_offsets(self, length: int) -> list:
+        """Tile starts along one axis; the last tile is aligned to the far edge so every pixel is covered"""
+        offsets = list(range(0, max(length - self.tile_size, 0) + 1, self.tile_size))
+        if length > self.tile_size and offsets[-1] + self.tile_size < length:
+            offsets.append(length - self.tile_size)
+        return offsets
+
+    def _classify_tiled(self, image: Image.Image) -> Tuple[int, float, int]:
+        """
+        Run the full model over native-resolution tiles; the most severe tile wins.
+        Tiles go through the pooled input buffers batch_size at a time, so a large photo
+        costs more forward passes rather than a bigger one
+        """
+        width, height = image.size
+        boxes = [(left, top) for top in self._tile_offsets(height) for left in self._tile_offsets(width)]
+        worst = (-1.0, 0, 0.0)  # (severity score, class, confidence)
+        for chunk_start in range(0, len(boxes), self.input_pool.batch_size):
+            chunk = boxes[chunk_start:chunk_start + self.input_pool.batch_size]
+            with self.input_pool.batch() as buffer:
+                for index, (left, top) in enumerate(chunk):
+                    self.input_pool.fill(buffer[index], image.crop((left, top, left + self.tile_size, top + self.tile_size)))
+                with torch.inference_mode():
+                    probabilities = torch.softmax(self.model(self.input_pool.to_device(buffer, len(chunk))), dim=1)
+                    confidences, predicted_classes = torch.max(probabilities, 1)
+            scores = predicted_classes * 2 + confidences
+            index = int(torch.argmax(scores).item())
+            if scores[index].item() > worst[0]:
+                worst = (scores[index].item(), predicted_classes[index].item(), confidences[index].item())
+        return worst[1], worst[2], len(boxes)
+
+    def _predict_cascade(self, image_path: str) -> Tuple[int, float, Dict[str, Any]]:
+        """Screen at low resolution, escalating uncertain or damaged images to the full model"""
+        image = self._open(image_path)
+        
+        start = time.perf_counter()
+        predicted_class, confidence_score = self._classify_image(self.screening_model, self.screening_pool, image)
+        screening_time = time.perf_counter() - start
+        
+        screened_as_no_damage = predicted_class == 0
+        resolved = screened_as_no_damage and confidence_score >= self.cascade_threshold
+        full_model_time = 0.0
+        if resolved:
+            stage_info = {"stage": "screening", "processed_size": "128x128"}
+        else:
+            start = time.perf_counter()
+            width, height = image.size
+            if self.escalation_mode == "tiled" and min(width, height) >= self.tile_size * 2:
+                predicted_class, confidence_score, num_tiles = self._classify_tiled(image)
+                stage_info = {"stage": "full", "processed_size": f"{num_tiles}x{self.tile_size}x{self.tile_size} tiles"}
+            else:
+                predicted_class, confidence_score = self._classify_image(self.model, self.input_pool, image)
+                stage_info = {"stage": "full", "processed_size": "512x512"}
+            full_model_time = time.perf_counter() - start
+        
+        with self._stats_lock:
+            self.routing_stats["total"] += 1
+            self.routing_stats["screening_time_s"] += screening_time
+            self.routing_stats["full_model_time_s"] += full_model_time
+            if resolved:
+                self.routing_stats["resolved_at_screening"] += 1
+            elif screened_as_no_damage:
+                self.routing_stats["escalated_uncertain"] += 1
+            else:
+                self.routing_stats["escalated_damage"] += 1
+        
+        return predicted_class, confidence_score, stage_info
+
     def predict_damage(self, image_path: str, state: str = "punjab") -> Dict[str, Any]:
         """
         Predict flood damage from image
         Returns Indian-specific damage assessment
         """
         try:
-            # Preprocess image
-            image_tensor = self.preprocess_image(image_path)
-            
-            # Run inference
-            with torch.no_grad():
-                outputs = self.model(image_tensor)
-                probabilities = torch.softmax(outputs, dim=1)
-                confidence, predicted_class = torch.max(probabilities, 1)
+            if self.cascade:
+                predicted_class, confidence_score, stage_info = self._predict_cascade(image_path)
+            else:
+                # Decode into a pooled input buffer and run inference
+                image = self._open(image_path)
+                predicted_class, confidence_score = self._classify_image(self.model, self.input_pool, image)
+                stage_info = {"stage": "full", "processed_size": "512x512"}
                 
-            # Get prediction
-            predicted_class = predicted_class.item()
-            confidence_score = confidence.item()
-            damage_class = self.damage_classes[predicted_class]
-            
-            # Map to Indian damage assessment
-            damage_assessment = self.damage_mapper.map_damage_level(
-                damage_class, confidence_score, state
+            # Map to Indian damage assessment and add model metadata
+            damage_assessment = self._assessment(
+                predicted_class, confidence_score, state, image_path, stage_info["processed_size"]
             )
-            
-            # Add model metadata
-            damage_assessment.update({
-                "model_info": {
-                    "model_name": "xView2-ResNet50-FPN",
-                    "version": "1.0",
-                    "confidence_threshold": 0.5
-                },
-                "image_info": {
-                    "path": image_path,
-                    "processed_size": "512x512"
-                }
-            })
+            damage_assessment["model_info"]["cascade_stage"] = stage_info["stage"]
             
             return damage_assessment
             
@@ -142,24 +262,95 @@ class xView2Inference:
                 "confidence": 0.0
             }
 
+    def _assessment(self, predicted_class: int, confidence_score: float, state: str,
+                    image_path: str, processed_size: str = "512x512") -> Dict[str, Any]:
+        damage_assessment = self.damage_mapper.map_damage_level(
+            self.damage_classes[predicted_class], confidence_score, state
+        )
+        damage_assessment.update({
+            "model_info": {
+                "model_name": "xView2-ResNet50-FPN",
+                "version": "1.0",
+                "confidence_threshold": 0.5,
+                "cascade_stage": "full"
+            },
+            "image_info": {
+                "path": image_path,
+                "processed_size": processed_size
+            }
+        })
+        return damage_assessment
+
     def batch_predict(self, image_paths: list, state: str = "punjab") -> list:
-        """Predict damage for multiple images"""
+        """Predict damage for multiple images, batching forward passes by self.batch_size"""
+        if self.cascade or self.batch_size <= 1:
+            return [self.predict_damage(image_path, state) for image_path in image_paths]
+        
         results = []
-        for image_path in image_paths:
-            result = self.predict_damage(image_path, state)
-            results.append(result)
+        for chunk_start in range(0, len(image_paths), self.batch_size):
+            chunk = image_paths[chunk_start:chunk_start + self.batch_size]
+            chunk_results = [None] * len(chunk)
+            positions = []
+            with self.input_pool.batch() as buffer:
+                for position, image_path in enumerate(chunk):
+                    try:
+                        self.input_pool.fill(buffer[len(positions)], self._open(image_path))
+                        positions.append(position)
+                    except Exception as e:
+                        chunk_results[position] = {
+                            "error": f"Prediction failed: {str(e)}",
+                            "damage_level": "Unknown",
+                            "confidence": 0.0
+                        }
+                
+                if positions:
+                    with torch.inference_mode():
+                        outputs = self.model(self.input_pool.to_device(buffer, len(positions)))
+                        probabilities = torch.softmax(outputs, dim=1)
+                        confidences, predicted_classes = torch.max(probabilities, 1)
+            for index, position in enumerate(positions):
+                chunk_results[position] = self._assessment(
+                    predicted_classes[index].item(), confidences[index].item(), state, chunk[position]
+                )
+            results.extend(chunk_results)
         return results
 
+    def get_routing_stats(self) -> Dict[str, Any]:
+        """Get per-stage cascade routing statistics"""
+        with self._stats_lock:
+            stats = dict(self.routing_stats)
+        escalated = stats["total"] - stats["resolved_at_screening"]
+        stats["escalation_rate"] = round(escalated / stats["total"], 4) if stats["total"] else 0.0
+        stats["mean_screening_ms"] = round(stats["screening_time_s"] * 1000 / stats["total"], 2) if stats["total"] else 0.0
+        stats["mean_full_model_ms"] = round(stats["full_model_time_s"] * 1000 / escalated, 2) if escalated else 0.0
+        return stats
+
     def get_model_info(self) -> Dict[str, Any]:
         """Get model information"""
-        return {
+        info = {
             "model_name": "xView2 Flood Damage Detection",
             "version": "1.0",
             "device": str(self.device),
             "num_classes": len(self.damage_classes),
             "classes": list(self.damage_classes.values()),
-            "supported_states": list(self.damage_mapper.state_relief_amounts.keys())
+            "supported_states": list(self.damage_mapper.state_relief_amounts.keys()),
+            "runtime": {
+                "intra_op_threads": torch.get_num_threads(),
+                "interop_threads": torch.get_num_interop_threads(),
+                "batch_size": self.batch_size,
+                "input_buffers": self.input_pool.buffers,
+                "input_buffer_mb": round(self.input_pool.nbytes() / 2**20, 1),
+                "autotune": self.runtime_config
+            }
         }
+        if self.cascade:
+            info["cascade"] = {
+                "enabled": True,
+                "threshold": self.cascade_threshold,
+                "escalation_mode": self.escalation_mode,
+                "routing_stats": self.get_routing_stats()
+            }
+        return info
 
 # Example usage
 if __name__ == "__main__":
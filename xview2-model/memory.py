@@ -0,0 +1,154 @@
+"""
+Inference Memory Management
+Preallocated input buffer pool and an RSS watchdog for long-running Cloud Run workers
+"""
+
+import ctypes
+import gc
+import logging
+import os
+import queue
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+import numpy as np
+import torch
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+IMAGENET_MEAN = torch.tensor([0.485, 0.456, 0.406]).view(3, 1, 1)
+IMAGENET_STD = torch.tensor([0.229, 0.224, 0.225]).view(3, 1, 1)
+
+
+class TensorBufferPool:
+    """
+    Fixed set of preallocated (batch, 3, size, size) input tensors
+    Buffers are reused across requests instead of allocating a fresh tensor per call;
+    on CUDA they are pinned so host-to-device copies can be asynchronous
+    """
+
+    def __init__(self, size: int, batch_size: int = 1, buffers: int = 1, device: torch.device = torch.device("cpu")):
+        self.size = size
+        self.batch_size = batch_size
+        self.device = device
+        self.pin = device.type == "cuda"
+        self._free = queue.Queue()
+        for _ in range(max(1, buffers)):
+            self._free.put(torch.empty((batch_size, 3, size, size), dtype=torch.float32, pin_memory=self.pin))
+        self.buffers = max(1, buffers)
+
+    @contextmanager
+    def batch(self):
+        """Borrow one input batch buffer for the duration of a forward pass"""
+        buffer = self._free.get()
+        try:
+            yield buffer
+        finally:
+            self._free.put(buffer)
+
+    def fill(self, slot: torch.Tensor, image: Image.Image):
+        """Resize an image and write it, normalised, into one slot of a pooled buffer in place"""
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        if image.size != (self.size, self.size):
+            image = image.resize((self.size, self.size), Image.BILINEAR)
+        pixels = torch.from_numpy(np.array(image, dtype=np.uint8)).permute(2, 0, 1)
+        slot.copy_(pixels)
+        slot.div_(255.0).sub_(IMAGENET_MEAN).div_(IMAGENET_STD)
+
+    def to_device(self, buffer: torch.Tensor, count: int) -> torch.Tensor:
+        view = buffer[:count]
+        if self.device.type == "cpu":
+            return view
+        return view.to(self.device, non_blocking=self.pin)
+
+    def nbytes(self) -> int:
+        return self.buffers * self.batch_size * 3 * self.size * self.size * 4
+
+
+def open_image(image_path: str, size: int) -> Image.Image:
+    """Open an image, letting the JPEG decoder downscale while decoding when it is much larger than needed"""
+    image = Image.open(image_path)
+    image.draft('RGB', (size, size))
+    return image.convert('RGB')
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # Peak, not current, but the best available without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _malloc_trim():
+    """Return freed heap pages to the OS (glibc only)"""
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+class MemoryWatchdog:
+    """
+    Samples RSS in the background
+    Above the soft limit it collects garbage and trims the allocator; above the hard limit
+    it flags the worker as over its cap so new inference is refused until memory falls back
+    """
+
+    def __init__(self, soft_limit_mb: float, hard_limit_mb: float, interval_s: float = 5.0):
+        self.soft_limit = soft_limit_mb * 1024 * 1024
+        self.hard_limit = hard_limit_mb * 1024 * 1024
+        self.interval_s = interval_s
+        self.over_limit = False
+        self.rss = current_rss_bytes()
+        self.peak_rss = self.rss
+        self.trims = 0
+        self.refusals = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="memory-watchdog", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self.check()
+
+    def check(self):
+        self.rss = current_rss_bytes()
+        self.peak_rss = max(self.peak_rss, self.rss)
+        if self.rss > self.soft_limit:
+            gc.collect()
+            _malloc_trim()
+            self.trims += 1
+            self.rss = current_rss_bytes()
+        was_over = self.over_limit
+        self.over_limit = self.rss > self.hard_limit
+        if self.over_limit and not was_over:
+            logger.warning(f"RSS {self.rss / 2**20:.0f} MB above hard limit, refusing new inference")
+        elif was_over and not self.over_limit:
+            logger.info(f"RSS back to {self.rss / 2**20:.0f} MB, accepting inference")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "rss_mb": round(self.rss / 2**20, 1),
+            "peak_rss_mb": round(self.peak_rss / 2**20, 1),
+            "soft_limit_mb": round(self.soft_limit / 2**20, 1),
+            "hard_limit_mb": round(self.hard_limit / 2**20, 1),
+            "over_limit": self.over_limit,
+            "trims": self.trims,
+            "refusals": self.refusals,
+            "sampled_at": time.time()
+        }
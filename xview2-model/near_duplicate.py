@@ -0,0 +1,161 @@
+"""
+Near-Duplicate Image Detection
+Perceptual hashing (dHash) with a BK-tree index so burst shots, crops and recompressed
+forwards of the same structure reuse one assessment instead of being inferred and counted again
+"""
+
+import itertools
+import math
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from PIL import Image
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """Difference hash: compares neighbouring pixels of a small grayscale thumbnail"""
+    thumbnail = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(thumbnail.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in metres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(a))
+
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance for radius queries"""
+
+    def __init__(self):
+        self.root = None  # [hash, items, {distance: child}]
+        self.size = 0
+
+    def add(self, hash_value: int, item: Any):
+        self.size += 1
+        if self.root is None:
+            self.root = [hash_value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, [item], {}]
+                return
+            node = child
+
+    def search(self, hash_value: int, radius: int) -> List[Tuple[int, Any]]:
+        """All (distance, item) pairs within radius, nearest first"""
+        if self.root is None:
+            return []
+        matches = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= radius:
+                matches.extend((distance, item) for item in node[1])
+            # Triangle inequality: only children in [d - r, d + r] can hold matches
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+class NearDuplicateIndex:
+    """
+    Index of completed assessments keyed by perceptual hash
+    A new image matches a stored one when its hash is within max_distance bits, the
+    state is the same and both carry GPS coordinates within radius_m of each other.
+    Images without coordinates are never matched against other requests: low-texture
+    flood photos hash alike, and a false match would drop a structure from relief totals
+    """
+
+    def __init__(self, max_distance: int = 6, radius_m: float = 50.0, max_entries: int = 50000):
+        self.max_distance = max_distance
+        self.radius_m = radius_m
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._tree = BKTree()
+        self._entries: List[Dict[str, Any]] = []
+        self._ids = itertools.count(1)
+        self.stats = {"lookups": 0, "hits": 0}
+
+    def hash_image(self, image_path: str) -> int:
+        with Image.open(image_path) as image:
+            return dhash(image)
+
+    def lookup(self, hash_value: int, state: str, latitude: Optional[float] = None,
+               longitude: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Return the closest stored entry that counts as the same structure, if any"""
+        if latitude is None or longitude is None:
+            return None
+        with self._lock:
+            self.stats["lookups"] += 1
+            for distance, entry in self._tree.search(hash_value, self.max_distance):
+                if entry["state"] != state:
+                    continue
+                distance_m = haversine_m(latitude, longitude, entry["latitude"], entry["longitude"])
+                if distance_m > self.radius_m:
+                    continue
+                self.stats["hits"] += 1
+                return {**entry, "hash_distance": distance, "distance_m": distance_m}
+        return None
+
+    def new_id(self, hash_value: int) -> str:
+        return f"{hash_value:016x}-{next(self._ids)}"
+
+    def add(self, hash_value: int, assessment: Dict[str, Any], state: str,
+            latitude: Optional[float] = None, longitude: Optional[float] = None) -> str:
+        """Store a completed assessment and return its id; only located assessments are indexed"""
+        if latitude is None or longitude is None:
+            return self.new_id(hash_value)
+        with self._lock:
+            entry = {
+                "assessment_id": self.new_id(hash_value),
+                "hash": hash_value,
+                "assessment": assessment,
+                "state": state,
+                "latitude": latitude,
+                "longitude": longitude,
+                "created_at": time.time()
+            }
+            self._entries.append(entry)
+            self._tree.add(hash_value, entry)
+            if len(self._entries) > self.max_entries:
+                self._rebuild(self._entries[len(self._entries) // 2:])
+            return entry["assessment_id"]
+
+    def _rebuild(self, entries: List[Dict[str, Any]]):
+        # BK-trees have no cheap delete, so drop the oldest half by rebuilding
+        self._entries = entries
+        self._tree = BKTree()
+        for entry in entries:
+            self._tree.add(entry["hash"], entry)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.stats,
+                "entries": len(self._entries),
+                "max_distance": self.max_distance,
+                "radius_m": self.radius_m
+            }
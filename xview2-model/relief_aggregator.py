@@ -0,0 +1,247 @@
+"""
+Streaming Relief Cost Aggregation
+Running SDRF budget totals per state, district and NDMA category, fed by each damage assessment
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+
+class TDigest:
+    """Minimal merging t-digest for approximate quantiles over a stream"""
+
+    def __init__(self, compression: int = 100):
+        self.compression = compression
+        self.centroids: List[List[float]] = []  # [mean, weight], sorted by mean
+        self.buffer: List[float] = []
+        self.count = 0
+
+    def add(self, value: float, weight: float = 1.0):
+        self.buffer.append(float(value))
+        self.count += weight
+        if len(self.buffer) >= self.compression * 4:
+            self._compress()
+
+    def merge(self, *others: "TDigest"):
+        """Fold in any number of digests with a single compression pass"""
+        for other in others:
+            other._compress()
+            self.centroids.extend([mean, weight] for mean, weight in other.centroids)
+            self.count += other.count
+        self.centroids.sort(key=lambda c: c[0])
+        self._compress(force=True)
+
+    def copy(self) -> "TDigest":
+        self._compress()
+        digest = TDigest(self.compression)
+        digest.centroids = [list(c) for c in self.centroids]
+        digest.count = self.count
+        return digest
+
+    def _compress(self, force: bool = False):
+        if not self.buffer and not force:
+            return
+        points = self.centroids + [[v, 1.0] for v in self.buffer]
+        self.buffer = []
+        if not points:
+            return
+        points.sort(key=lambda c: c[0])
+
+        total = sum(w for _, w in points)
+        merged = [list(points[0])]
+        cumulative = 0.0
+        for mean, weight in points[1:]:
+            last = merged[-1]
+            # Size limit follows q(1-q) so the tails keep small, accurate centroids
+            q = (cumulative + last[1] + weight / 2.0) / total
+            limit = max(1.0, 4.0 * total * q * (1.0 - q) / self.compression)
+            if last[1] + weight <= limit:
+                new_weight = last[1] + weight
+                last[0] += (mean - last[0]) * weight / new_weight
+                last[1] = new_weight
+            else:
+                cumulative += last[1]
+                merged.append([mean, weight])
+        self.centroids = merged
+
+    def quantile(self, q: float) -> Optional[float]:
+        self._compress()
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+
+        total = sum(w for _, w in self.centroids)
+        target = q * total
+        cumulative = 0.0
+        for i, (mean, weight) in enumerate(self.centroids):
+            midpoint = cumulative + weight / 2.0
+            if target <= midpoint:
+                if i == 0:
+                    return mean
+                prev_mean, prev_weight = self.centroids[i - 1]
+                prev_midpoint = cumulative - prev_weight / 2.0
+                fraction = (target - prev_midpoint) / (midpoint - prev_midpoint)
+                return prev_mean + fraction * (mean - prev_mean)
+            cumulative += weight
+        return self.centroids[-1][0]
+
+
+class _RunningTotals:
+    """Sums, count and cost quantiles for one group over one time span"""
+
+    def __init__(self, compression: int):
+        self.count = 0
+        self.estimated_cost_min = 0
+        self.estimated_cost_max = 0
+        self.estimated_cost_avg = 0
+        self.relief_amount = 0
+        self.cost_digest = TDigest(compression)
+
+    def add(self, assessment: Dict[str, Any]):
+        self.count += 1
+        self.estimated_cost_min += assessment.get("estimated_cost_min", 0)
+        self.estimated_cost_max += assessment.get("estimated_cost_max", 0)
+        self.estimated_cost_avg += assessment.get("estimated_cost_avg", 0)
+        self.relief_amount += assessment.get("relief_amount", 0)
+        self.cost_digest.add(assessment.get("estimated_cost_avg", 0))
+
+    def merge(self, *others: "_RunningTotals"):
+        for other in others:
+            self.count += other.count
+            self.estimated_cost_min += other.estimated_cost_min
+            self.estimated_cost_max += other.estimated_cost_max
+            self.estimated_cost_avg += other.estimated_cost_avg
+            self.relief_amount += other.relief_amount
+        self.cost_digest.merge(*(other.cost_digest for other in others))
+
+    def copy(self) -> "_RunningTotals":
+        totals = _RunningTotals(self.cost_digest.compression)
+        totals.count = self.count
+        totals.estimated_cost_min = self.estimated_cost_min
+        totals.estimated_cost_max = self.estimated_cost_max
+        totals.estimated_cost_avg = self.estimated_cost_avg
+        totals.relief_amount = self.relief_amount
+        totals.cost_digest = self.cost_digest.copy()
+        return totals
+
+    def to_dict(self, quantiles: Tuple[float, ...]) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "estimated_cost_min_total": self.estimated_cost_min,
+            "estimated_cost_max_total": self.estimated_cost_max,
+            "estimated_cost_avg_total": self.estimated_cost_avg,
+            "relief_amount_total": self.relief_amount,
+            "estimated_cost_quantiles": {
+                f"p{int(q * 100)}": _round_or_none(self.cost_digest.quantile(q)) for q in quantiles
+            }
+        }
+
+
+def _round_or_none(value: Optional[float]) -> Optional[int]:
+    return None if value is None else int(round(value))
+
+
+class ReliefAggregator:
+    """
+    Incremental aggregation of relief cost estimates
+    Keeps all-time totals plus per-minute buckets for the last hour and per-hour buckets
+    for the last day, so a window view merges at most ~60 buckets per group instead of
+    re-reading assessments. Windows are exact to their bucket size
+    """
+
+    WINDOWS = {"last_hour": 3600, "last_day": 86400}
+    DIMENSIONS = ("state", "district", "ndma_category")
+
+    def __init__(self, bucket_seconds: int = 60, day_bucket_seconds: int = 3600, compression: int = 100,
+                 quantiles: Tuple[float, ...] = (0.5, 0.9, 0.99)):
+        self.bucket_seconds = {"last_hour": bucket_seconds, "last_day": day_bucket_seconds}
+        self.compression = compression
+        self.quantiles = quantiles
+        self._lock = threading.Lock()
+        # (dimension, value) -> all-time totals
+        self._totals: Dict[Tuple[str, str], _RunningTotals] = {}
+        # (dimension, value) -> window -> deque of (bucket_start, totals)
+        self._buckets: Dict[Tuple[str, str], Dict[str, deque]] = {}
+
+    def record(self, assessment: Dict[str, Any], district: Optional[str] = None,
+               timestamp: Optional[float] = None):
+        """Fold one completed assessment from IndianDamageMapper.map_damage_level into the totals"""
+        if "error" in assessment:
+            return
+
+        timestamp = time.time() if timestamp is None else timestamp
+        groups = {
+            "state": (assessment.get("state") or "default").lower(),
+            "district": (district or "unknown").strip().lower(),
+            "ndma_category": assessment.get("ndma_category", "N/A")
+        }
+
+        with self._lock:
+            for dimension, value in groups.items():
+                key = (dimension, value)
+                if key not in self._totals:
+                    self._totals[key] = _RunningTotals(self.compression)
+                    self._buckets[key] = {window: deque() for window in self.WINDOWS}
+                self._totals[key].add(assessment)
+
+                for window, buckets in self._buckets[key].items():
+                    size = self.bucket_seconds[window]
+                    self._bucket_for(buckets, int(timestamp // size) * size).add(assessment)
+                    self._expire(buckets, window, max(timestamp, buckets[-1][0]))
+
+    def _bucket_for(self, buckets: deque, bucket_start: int) -> _RunningTotals:
+        if not buckets or buckets[-1][0] < bucket_start:
+            buckets.append((bucket_start, _RunningTotals(self.compression)))
+            return buckets[-1][1]
+        # Late arrivals (slow requests finishing after newer ones) land in their own bucket
+        for index in range(len(buckets) - 1, -1, -1):
+            start, totals = buckets[index]
+            if start == bucket_start:
+                return totals
+            if start < bucket_start:
+                buckets.insert(index + 1, (bucket_start, _RunningTotals(self.compression)))
+                return buckets[index + 1][1]
+        buckets.appendleft((bucket_start, _RunningTotals(self.compression)))
+        return buckets[0][1]
+
+    def _expire(self, buckets: deque, window: str, now: float):
+        # Drop buckets that ended before the window opened
+        while buckets and buckets[0][0] + self.bucket_seconds[window] <= now - self.WINDOWS[window]:
+            buckets.popleft()
+
+    def snapshot(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """Current totals for every group, all-time and per window"""
+        now = time.time() if now is None else now
+        snapshot = {
+            "generated_at": now,
+            "all_time": {dimension: {} for dimension in self.DIMENSIONS},
+            **{window: {dimension: {} for dimension in self.DIMENSIONS} for window in self.WINDOWS}
+        }
+
+        # Copy under the lock, merge outside it so record() on the inference path never waits on a merge
+        with self._lock:
+            copies = []
+            for key, totals in self._totals.items():
+                windows = {}
+                for window, buckets in self._buckets[key].items():
+                    self._expire(buckets, window, now)
+                    windows[window] = [bucket.copy() for _, bucket in buckets]
+                copies.append((key, totals.copy(), windows))
+
+        for (dimension, value), totals, windows in copies:
+            snapshot["all_time"][dimension][value] = totals.to_dict(self.quantiles)
+            for window, buckets in windows.items():
+                if buckets:
+                    window_totals = _RunningTotals(self.compression)
+                    window_totals.merge(*buckets)
+                    snapshot[window][dimension][value] = window_totals.to_dict(self.quantiles)
+
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+            self._buckets.clear()
@@ -0,0 +1,19 @@
+import torch
+
+import autotune
+from inference import xView2Inference
+
+
+def test_candidates_over_the_memory_limit_are_not_tried():
+    model = xView2Inference().model
+    bytes_per_image = autotune.activation_bytes(model, torch.device("cpu"))
+    # The first ReLU holds its 64x512x512 float input and output at once
+    assert bytes_per_image == 2 * 64 * 512 * 512 * 4
+
+    candidates = autotune.default_candidates(4)
+    fits, over_memory = autotune.fit_memory(candidates, bytes_per_image, 1024 * 2**20)
+    assert fits and all(workers * batch_size * bytes_per_image <= 1024 * 2**20 for _, workers, batch_size in fits)
+    assert (1, 4, 8) in over_memory
+
+    fits, over_memory = autotune.fit_memory(candidates, bytes_per_image, 0)
+    assert fits == [(4, 1, 1)]
@@ -0,0 +1,22 @@
+import numpy as np
+import torch.nn as nn
+from PIL import Image
+
+from inference import xView2Inference
+
+
+def test_large_image_is_classified_in_bounded_batches(tmp_path):
+    inference = xView2Inference(cascade=True, cascade_threshold=1.01, escalation_mode="tiled")
+    inference.configure_buffers(batch_size=4, workers=1)
+    # Cheap stand-in for the full model; only the shape of its forward passes matters here
+    inference.model = nn.Sequential(nn.AdaptiveAvgPool2d(1), nn.Flatten(), nn.Linear(3, 4))
+    forward_batches = []
+    inference.model.register_forward_hook(lambda module, inputs, output: forward_batches.append(inputs[0].shape[0]))
+
+    path = tmp_path / "phone_photo.jpg"
+    Image.fromarray(np.random.default_rng(0).integers(0, 256, (3000, 4000, 3), dtype=np.uint8)).save(path)
+    result = inference.predict_damage(str(path), "kerala")
+
+    # 4000x3000 is 8x6 tiles of 512 px, classified four at a time instead of in one 48-tile pass
+    assert result["image_info"]["processed_size"] == "48x512x512 tiles"
+    assert forward_batches == [4] * 12
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import api
+from near_duplicate import NearDuplicateIndex
+from relief_aggregator import ReliefAggregator
+
+
+class StubModel:
+    """Records which images reach the model and assesses each as major damage."""
+
+    def __init__(self):
+        self.assessed = []
+
+    def batch_predict(self, image_paths, state):
+        self.assessed.extend(image_paths)
+        return [api.damage_mapper.map_damage_level("major-damage", 0.9, state) for _ in image_paths]
+
+
+@pytest.fixture
+def burst(tmp_path, monkeypatch):
+    """Two recompressions of the same low-texture photo, which hash alike."""
+    model = StubModel()
+    monkeypatch.setattr(api, "duplicate_index", NearDuplicateIndex())
+    monkeypatch.setattr(api, "relief_aggregator", ReliefAggregator())
+    monkeypatch.setattr(api, "get_model", lambda: model)
+    small = np.random.default_rng(1).integers(80, 120, (6, 8, 3), dtype=np.uint8)
+    pixels = np.asarray(Image.fromarray(small).resize((800, 600), Image.BICUBIC))
+    paths = []
+    for quality in (95, 60):
+        path = tmp_path / f"photo_q{quality}.jpg"
+        Image.fromarray(pixels).save(path, quality=quality)
+        paths.append(str(path))
+    return model, paths
+
+
+def test_untagged_look_alikes_are_grouped_but_each_assessed_and_counted(burst):
+    model, paths = burst
+
+    first, second = api.assess_images(paths, "kerala")
+
+    assert model.assessed == paths
+    assert api.relief_aggregator.snapshot()["all_time"]["state"]["kerala"]["count"] == 2
+    assert second["near_duplicate"]["duplicate_of"] == first["assessment_id"]
+    assert second["near_duplicate"]["reused"] is False
+
+
+def test_geotagged_duplicates_reuse_one_assessment(burst):
+    model, paths = burst
+
+    first, second = api.assess_images(paths, "kerala", latitude=9.93, longitude=76.26)
+
+    assert model.assessed == paths[:1]
+    assert api.relief_aggregator.snapshot()["all_time"]["state"]["kerala"]["count"] == 1
+    assert second["near_duplicate"]["duplicate_of"] == first["assessment_id"]
+    assert second["near_duplicate"]["reused"] is True